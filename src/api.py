@@ -1,13 +1,24 @@
+import time
 import typing
+import queue
+import threading
+import concurrent.futures
 import download
 import formatting
 import image
+import progress
+import journal
+import scheduler
+import lazy
 
 DEBUG = 0
 INFO = 1
 WARNING = 2
 ERROR = 3
 
+# tells a post processing worker there is no more work
+_STOP = None
+
 # name originates from mispronounciation of MusAPI
 class MusHappy:
     """API to handle downloading and tagging of music files."""
@@ -17,6 +28,18 @@ class MusHappy:
         self.music_handler = formatting.MusicFormatHandler()
         self.image_handler = image.ImageFormatHandler()
         self.logger = None
+        self.scheduler = scheduler.DownloadScheduler(
+            self.download_handler.config,
+            self.log
+        )
+
+        self._progress_lock = threading.Lock()
+        self._progress_done = 0
+        self._progress_total = 0
+        self._errors:list[Exception] = []
+        self.track_errors:list[dict[str,str]] = []
+        self._source_items:list[int] = []
+        self.work_list:list[dict[str,typing.Any]] = []
 
     def get_config(self) -> dict[str, typing.Any]:
         """
@@ -35,6 +58,7 @@ class MusHappy:
         self.download_handler.set_config(configs["download"])
         self.music_handler.set_config(configs["formatting"])
         self.image_handler.set_config(configs["image"])
+        self.scheduler.reset()
 
     def set_logger(self, logger:object) -> None:
         """
@@ -54,6 +78,42 @@ class MusHappy:
         self.music_handler.save_config()
         self.image_handler.save_config()
 
+    def get_unfinished_urls(self) -> list[str]:
+        """
+        Get the URLs of a job that was interrupted,
+        running them again resumes the job.
+
+        :returns urls:
+        URLs of the interrupted job, empty if there is none.
+        """
+        return self.download_handler.journal.get_unfinished_urls()
+
+    def get_download_profiles(self) -> list[str]:
+        """Get the names of the download profiles."""
+        return self.download_handler.get_profile_names()
+
+    def load_libraries(self) -> dict[str,float]:
+        """
+        Import the libraries and allowed extractors used by the handlers,
+        they are otherwise imported when the first job needs them.
+
+        :returns timings:
+        Seconds taken to import each library, by name.
+        """
+        timings = lazy.load_all([
+            download.yt_dlp,
+            download.hooks,
+            formatting.eyed3,
+            formatting.frames,
+            image.np,
+            image.cv2
+        ])
+
+        start = time.perf_counter()
+        self.download_handler.load_extractors()
+        timings["extractors"] = time.perf_counter() - start
+        return timings
+
     def get_valid_ai_models(self) -> list[str]:
         """Get available ai models."""
         return self.image_handler.config.get_valid_ai_models()
@@ -67,34 +127,437 @@ class MusHappy:
         Download the URLs from the list
         and perform all the appropriate tagging.
 
+        The metadata of every URL is fetched first, so the number of items
+        is known before downloading starts.
+        Downloading and post processing run as separate stages joined
+        by a bounded queue, so the next item downloads while the previous
+        one is tagged and has its cover processed.
+
         :param url_list:
         The list of URLs as strings to be downloaded.
         """
-        for i, url in enumerate(url_list):
-            self.log(f"[mushappy] Downloading item {i} of {len(url_list)}")
-            info_clean = self.download_handler.download_url(url)
+        config = self.download_handler.config
+
+        # carry on from an interrupted run of the same urls
+        resumed = self.download_handler.journal.begin(url_list)
+
+        # plan the whole job before any media is downloaded
+        self.work_list = self.download_handler.prefetch(url_list)
+        self.download_handler.journal.add_items(self.work_list)
+        if resumed:
+            position, total = self.download_handler.journal.get_resume_point()
+            self.log(
+                f"[mushappy] Resuming interrupted job at item "
+                f"{position} of {total}",
+                INFO
+            )
+        self._log_work_list()
+
+        self._errors = []
+        self.track_errors = []
+        self._progress_done = 0
+        self._progress_total = 0
+
+        # items that failed are tried again, up to the attempt limit
+        max_attempts = max(1, int(config.get_value("max_item_attempts")))
+        pending = [
+            item for item in self.work_list
+            if not item["archived"] and not item["duplicate"]
+        ]
+        while len(pending) > 0:
+            self._run_pipeline(url_list, pending)
+            retry = set(self.download_handler.journal.record_attempt(
+                max_attempts
+            ))
+            pending = [item for item in pending if item["key"] in retry]
+            if len(pending) > 0:
+                self.log(
+                    f"[mushappy] Trying {len(pending)} failed items again",
+                    INFO
+                )
+
+        # clean up, an interrupted job never gets here and keeps
+        # its journal and scratch files to be resumed
+        try:
+            self.download_handler.journal.finish()
+            self.download_handler.clean()
+        finally:
+            # free the UI even if cleaning up failed
+            self.report(progress.ProgressEvent("", progress.STAGE_DONE))
+
+        if len(self._errors) > 0:
+            raise self._errors[0]
+
+    def _run_pipeline(
+            self,
+            url_list:list[str],
+            pending:list[dict[str,typing.Any]]
+        ) -> None:
+        """
+        Download and tag the URLs with pending items, once.
+
+        :param url_list:
+        The list of URLs as strings to be downloaded.
+
+        :param pending:
+        Work items to download.
+        """
+        config = self.download_handler.config
+        download_workers = max(
+            1, int(config.get_value("max_concurrent_downloads"))
+        )
+        process_workers = max(
+            1, int(config.get_value("max_concurrent_post_process"))
+        )
+        queue_size = max(1, int(config.get_value("pipeline_queue_size")))
+
+        self._source_items = [0] * len(url_list)
+        for item in pending:
+            self._source_items[item["source"]] += 1
+
+        url_queue = queue.Queue()
+        for source, url in enumerate(url_list):
+            if self._source_items[source] == 0:
+                # nothing new at this url
+                continue
+            url_queue.put((source, url))
+
+        # downloaders block when this is full, which stops
+        # the scratch directory growing faster than it is emptied
+        info_queue = queue.Queue(maxsize=queue_size)
+
+        # only the errors of the last attempt are raised
+        self._errors = []
+        self._progress_total += len(pending)
+        self._advance_progress(0)
+
+        with concurrent.futures.ThreadPoolExecutor(
+            download_workers + process_workers
+        ) as pool:
+            downloaders = [
+                pool.submit(self._download_stage, url_queue, info_queue)
+                for _ in range(download_workers)
+            ]
+            processors = [
+                pool.submit(self._process_stage, info_queue)
+                for _ in range(process_workers)
+            ]
+            try:
+                concurrent.futures.wait(downloaders)
+            finally:
+                for _ in processors:
+                    info_queue.put(_STOP)
+            concurrent.futures.wait(processors)
+
+    def _download_stage(
+            self,
+            url_queue:queue.Queue,
+            info_queue:queue.Queue
+        ) -> None:
+        """
+        Download URLs until there are none left
+        and pass the metadata to the post processing stage.
+
+        When items are processed early, each item is passed on as soon
+        as its audio is ready. Playlist items that share the most common
+        cover are tagged and finalized without it, and the cover is
+        attached once the whole playlist has been tagged.
+
+        :param url_queue:
+        URLs waiting to be downloaded.
+
+        :param info_queue:
+        Metadata of downloaded items and URLs waiting to be processed.
+        """
+        early = self.download_handler.config.get_value("process_items_early")
+        group_cover = self.image_handler.config.get_value("add_image_group") \
+            == image.PICK_GROUP_MOST_COMMON
+
+        while True:
+            try:
+                source, url = url_queue.get_nowait()
+            except queue.Empty:
+                return
+
+            sent = 0
+            # covers shared by the items of the url
+            clusters = image.CoverClusters()
+            # tracks waiting for the most common cover of the url
+            group = _CoverGroup()
+            # a retried url passes its finished items on again
+            seen = set()
+
+            def on_item(meta:dict[str,typing.Any]) -> None:
+                nonlocal sent
+                key = download.DownloadArchive.get_key(meta)
+                if key is not None:
+                    if key in seen:
+                        return
+                    seen.add(key)
+
+                sent += 1
+                # blocks while the post processing stage is behind
+                if group_cover and meta.get("playlist") is not None:
+                    group.expect()
+                    info_queue.put((1, meta, None, group))
+                else:
+                    info_queue.put((1, meta, clusters, None))
+
+            extractor = next(
+                (
+                    item["extractor"] for item in self.work_list
+                    if item["source"] == source
+                ),
+                None
+            )
+            try:
+                # waits for the host, and retries while it is throttling
+                info_clean = self.scheduler.run(
+                    url,
+                    extractor,
+                    lambda: self.download_handler.download_url( #pylint: disable=W0640
+                        url,
+                        on_item if early else None,
+                        source
+                    )
+                )
+            except Exception as e: #pylint: disable=W0718
+                self._fail(e)
+                info_clean = {}
+
+            # the last of the tracks to be tagged attaches the cover
+            if group.close():
+                self._attach_group_cover(group)
+
+            # items not passed on individually are counted with the url
+            remaining = max(self._source_items[source] - sent, 0)
             if info_clean == {}:
+                self._advance_progress(remaining)
                 continue
 
-            # handle metadata
-            self.music_handler.set_info(info_clean)
-            self.music_handler.correct_metadata()
-            self.music_handler.tag_audio()
+            info_queue.put((remaining, info_clean, None, None))
 
-            # handle images
-            self.image_handler.set_info(info_clean)
-            self.image_handler.post_process()
+    def _process_stage(self, info_queue:queue.Queue) -> None:
+        """
+        Tag downloaded items and URLs until the download stage is finished.
 
-            # write images
-            _images = self.image_handler.get_images()
-            self.music_handler.tag_image(_images)
+        :param info_queue:
+        Metadata of downloaded items and URLs waiting to be processed.
+        """
+        while (task := info_queue.get()) is not _STOP:
+            count, info_clean, clusters, group = task
+            try:
+                self._tag_info(info_clean, clusters, group)
+            except Exception as e: #pylint: disable=W0718
+                self._fail(e)
+            if group is not None and group.done():
+                self._attach_group_cover(group)
+            self._advance_progress(count)
+
+    def _tag_info(
+            self,
+            info_clean:dict[str,typing.Any],
+            clusters:image.CoverClusters|None=None,
+            group:"_CoverGroup|None"=None
+        ) -> None:
+        """
+        Perform all the appropriate tagging for a downloaded URL.
+
+        :param info_clean:
+        A dictionary with all the metadata for the download task.
+
+        :param clusters:
+        Covers shared with the other items of the same URL,
+        if they are tagged one at a time.
+
+        :param group:
+        Tracks waiting for the most common cover of the URL, the cover
+        is left out and attached by `_attach_group_cover`.
+        """
+        # handlers hold per-url state, each worker needs its own
+        music_handler = self.music_handler.spawn()
+        image_handler = self.image_handler.spawn()
+        image_handler.set_clusters(clusters)
 
-            # write changes
-            self.music_handler.save()
-            self.music_handler.rename()
+        music_handler.set_info(info_clean)
+        if len(music_handler.formatters) == 0:
+            # every item was skipped
+            return
 
-        # clean up
-        self.download_handler.clean()
+        # handle images
+        _images = None
+        if group is None:
+            image_handler.set_info(info_clean)
+            image_handler.post_process()
+            _images = image_handler.get_images()
+            image_handler.release()
+            for inst in music_handler.formatters:
+                self._journal(inst, journal.ITEM_COVER)
+
+        def on_step(inst:formatting.MusicFormatter, step:str) -> None:
+            if step == "saved":
+                self._journal(inst, journal.ITEM_TAGGED)
+                return
+            if group is not None:
+                # only counts as finished once the cover is attached
+                group.add(inst.meta)
+                return
+            # record straight away, so an interruption cannot lose it
+            self.download_handler.record(inst.meta, inst.get_music_path())
+            self._journal(inst, journal.ITEM_FINALIZED)
+
+        # handle metadata and write changes, one track at a time
+        music_handler.process(
+            _images,
+            image_handler.get_mime(),
+            self.download_handler.get_output_directory(),
+            on_step
+        )
+
+        if group is None:
+            self._report_tracks(music_handler)
+            return
+
+        for inst in music_handler.failed:
+            self.report(progress.ProgressEvent(
+                download.DownloadArchive.get_key(inst.meta) or "",
+                progress.STAGE_FAILED,
+                title=inst.meta.get("title") or ""
+            ))
+        with self._progress_lock:
+            self.track_errors.extend(music_handler.errors)
+
+    def _attach_group_cover(self, group:"_CoverGroup") -> None:
+        """
+        Pick the most common cover of tracks that were finalized
+        without one, and attach it to each of them.
+
+        :param group:
+        Tracks of the URL, all tagged.
+        """
+        if len(group.entries) == 0:
+            return
+
+        info_clean = {"_type": "playlist", "entries": group.entries}
+        music_handler = self.music_handler.spawn()
+        image_handler = self.image_handler.spawn()
+        music_handler.set_info(info_clean)
+        image_handler.set_info(info_clean)
+
+        try:
+            image_handler.post_process()
+            _images = image_handler.get_images()
+        except Exception as e: #pylint: disable=W0718
+            # the tracks are kept, they are downloaded again next time
+            self._fail(e)
+            return
+        finally:
+            image_handler.release()
+
+        def on_step(inst:formatting.MusicFormatter, _step:str) -> None:
+            self.download_handler.record(inst.meta, inst.get_music_path())
+            self._journal(inst, journal.ITEM_FINALIZED)
+
+        music_handler.attach_covers(_images, image_handler.get_mime(), on_step)
+        self._report_tracks(music_handler)
+
+    def _report_tracks(
+            self,
+            music_handler:formatting.MusicFormatHandler
+        ) -> None:
+        """
+        Report the tracks of a handler as finished or failed,
+        and keep the errors of those that failed.
+
+        :param music_handler:
+        Handler that has processed its tracks.
+        """
+        for inst in music_handler.formatters:
+            if inst in music_handler.failed:
+                stage = progress.STAGE_FAILED
+            else:
+                stage = progress.STAGE_FINISHED
+            self.report(progress.ProgressEvent(
+                download.DownloadArchive.get_key(inst.meta) or "",
+                stage,
+                title=inst.meta.get("title") or ""
+            ))
+
+        with self._progress_lock:
+            self.track_errors.extend(music_handler.errors)
+
+    def _journal(self, inst:formatting.MusicFormatter, state:int) -> None:
+        """
+        Record how far a track has got in the journal.
+
+        :param inst:
+        Formatter of the track.
+
+        :param state:
+        State from :mod:`journal` the track has reached.
+        """
+        self.download_handler.journal.set_state(
+            download.DownloadArchive.get_key(inst.meta),
+            state,
+            inst.get_music_path()
+        )
+
+    def _log_work_list(self) -> None:
+        """Report the size of the job found by the metadata prefetch."""
+        items = len(self.work_list)
+        archived = sum(1 for item in self.work_list if item["archived"])
+        # an archived item is only counted as archived
+        duplicates = sum(
+            1 for item in self.work_list
+            if item["duplicate"] and not item["archived"]
+        )
+        pending = [
+            item for item in self.work_list
+            if not item["archived"] and not item["duplicate"]
+        ]
+        duration = sum(item["duration"] for item in pending)
+        size = sum(item["filesize_approx"] for item in pending)
+
+        hours, rem = divmod(int(duration), 3600)
+        minutes, seconds = divmod(rem, 60)
+        self.log(
+            f"[mushappy] Found {items} items, {archived} already downloaded, "
+            f"{duplicates} listed more than once, "
+            f"{hours}:{minutes:02}:{seconds:02} of audio, "
+            f"about {size / 1e6:.0f} MB to download",
+            INFO
+        )
+
+    def _advance_progress(self, count:int) -> None:
+        """
+        Count items as finished and report the overall progress.
+
+        :param count:
+        Number of items finished.
+        """
+        with self._progress_lock:
+            self._progress_done += count
+            self.log(
+                "[mushappy] Downloading item "
+                f"{self._progress_done} of {self._progress_total}"
+            )
+            self.report(progress.ProgressEvent(
+                "",
+                progress.STAGE_TOTAL,
+                items_done=self._progress_done,
+                items_total=self._progress_total
+            ))
+
+    def _fail(self, error:Exception) -> None:
+        """
+        Record an error without stopping the other workers.
+
+        :param error:
+        The exception raised while handling a URL.
+        """
+        with self._progress_lock:
+            self._errors.append(error)
+        self.log(f"[mushappy] {type(error).__name__}: {error}", WARNING)
 
     def log(self, message:str, level:int=DEBUG) -> None:
         """
@@ -116,3 +579,72 @@ class MusHappy:
                 self.logger.warning(message)
             elif level == ERROR:
                 self.logger.error(message)
+
+    def report(self, event:progress.ProgressEvent) -> None:
+        """
+        Send a progress event through the logger,
+        if the logger accepts them.
+
+        :param event:
+        Event to pass through the logger.
+        """
+        if self.logger is not None and hasattr(self.logger, "progress"):
+            self.logger.progress(event)
+
+class _CoverGroup:
+    """
+    Tracks of a playlist that are finalized as soon as they download,
+    waiting for the most common cover of the whole playlist.
+    Only what is needed to attach the cover is kept of each track.
+    """
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.entries:list[dict[str,typing.Any]] = []
+        # tracks passed on, and tracks the post processing is done with
+        self.expected = 0
+        self.finished = 0
+        self.closed = False
+
+    def expect(self) -> None:
+        """Count a track passed on to be tagged."""
+        with self.lock:
+            self.expected += 1
+
+    def add(self, meta:dict[str,typing.Any]) -> None:
+        """
+        Keep a finalized track until the cover is attached.
+
+        :param meta:
+        Metadata of the track.
+        """
+        entry = {
+            key: meta[key] for key in ["id", "extractor_key", "title"]
+            if key in meta
+        }
+        entry["_type"] = "video"
+        entry["thumbnails"] = meta["thumbnails"][-1:]
+        entry["requested_downloads"] = meta["requested_downloads"]
+        with self.lock:
+            self.entries.append(entry)
+
+    def done(self) -> bool:
+        """
+        Count a track the post processing is done with.
+
+        :returns ready:
+        `True` for the last track once the playlist has downloaded.
+        """
+        with self.lock:
+            self.finished += 1
+            return self.closed and self.finished == self.expected
+
+    def close(self) -> bool:
+        """
+        Mark the playlist as downloaded.
+
+        :returns ready:
+        `True` if every track has already been tagged.
+        """
+        with self.lock:
+            self.closed = True
+            return self.finished == self.expected
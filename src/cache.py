@@ -0,0 +1,117 @@
+import os
+import hashlib
+import threading
+import configure
+
+class CoverCache:
+    """
+    On-disk cache of processed cover art, kept between runs.
+    The least recently used covers are removed
+    when the cache grows past its size limit.
+    """
+    def __init__(self, config:configure.Config) -> None:
+        """
+        On-disk cache of processed cover art, kept between runs.
+
+        :param config:
+        Configuration with `"cache_directory"` and
+        `"cache_size_limit"` in megabytes, `0` disables the cache.
+        """
+        self.config = config
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_key(*parts:object) -> str:
+        """
+        Build a cache key from the input hash and processing parameters.
+
+        :param parts:
+        Values that change the processed cover.
+
+        :returns key:
+        Hash string used as the file name.
+        """
+        joined = "\n".join(str(part) for part in parts)
+        return hashlib.sha256(joined.encode("utf-8")).hexdigest()
+
+    def enabled(self) -> bool:
+        """Check if the cache is enabled."""
+        return self.config.get_value("cache_size_limit") > 0
+
+    def get(self, key:str) -> bytes|None:
+        """
+        Fetch a cover from the cache.
+
+        :param key:
+        Key from `get_key`.
+
+        :returns data:
+        Encoded cover or `None` if it is not cached.
+        """
+        if not self.enabled():
+            return None
+
+        path = self._get_path(key)
+        with self.lock:
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+            except OSError:
+                return None
+
+            # mark as recently used
+            os.utime(path)
+        return data
+
+    def put(self, key:str, data:bytes) -> None:
+        """
+        Store a cover in the cache and evict old covers if needed.
+
+        :param key:
+        Key from `get_key`.
+
+        :param data:
+        Encoded cover.
+        """
+        if not self.enabled():
+            return
+
+        directory = self.config.get_value("cache_directory")
+        path = self._get_path(key)
+        with self.lock:
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+
+            # write a copy first so a crash cannot leave a partial cover
+            temp_path = path + ".tmp"
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+
+            self._evict()
+
+    def _get_path(self, key:str) -> str:
+        """Get the file path of a cache key."""
+        directory = self.config.get_value("cache_directory")
+        return os.path.join(directory, key)
+
+    def _evict(self) -> None:
+        """Remove the least recently used covers until under the limit."""
+        directory = self.config.get_value("cache_directory")
+        limit = self.config.get_value("cache_size_limit") * 1024 * 1024
+
+        entries = []
+        total = 0
+        for entry in os.scandir(directory):
+            if not entry.is_file():
+                continue
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= limit:
+                break
+            os.remove(path)
+            total -= size
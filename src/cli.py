@@ -0,0 +1,354 @@
+import sys
+import json
+import time
+import typing
+import argparse
+import threading
+
+import api
+import image
+import progress
+
+GROUP_COVERS = {
+    "each": image.PICK_GROUP_EACH,
+    "most-common": image.PICK_GROUP_MOST_COMMON
+}
+
+# as listed by the image scaling box, 0 keeps the size of the cover
+INTERPOLATIONS = {
+    "none": 0,
+    "fastest": 1,
+    "balanced": 2,
+    "best": 3
+}
+
+class CliLogger():
+    """
+    Prints messages to stderr and records the progress of each item,
+    used to run MusHappy without the UI.
+    """
+
+    def __init__(self, quiet:bool=False) -> None:
+        self.quiet = quiet
+        self.lock = threading.Lock()
+        self.warnings:list[str] = []
+        # time each item reached each stage, by item id
+        self.stages:dict[str,dict[str,float]] = {}
+
+    def debug(self, msg:str):
+        """debug string"""
+        # yt-dlp passes info messages through debug too
+        if not msg.startswith('[debug] '):
+            self.info(msg)
+
+    def info(self, msg:str):
+        """info string"""
+        if not self.quiet:
+            print(msg, file=sys.stderr)
+
+    def warning(self, msg:str):
+        """warning string"""
+        print("WARNING: " + msg, file=sys.stderr)
+        with self.lock:
+            self.warnings.append(msg)
+
+    def error(self, msg:str):
+        """error string"""
+        print("ERROR: " + msg, file=sys.stderr)
+        with self.lock:
+            self.warnings.append(msg)
+
+    def progress(self, event:progress.ProgressEvent) -> None:
+        """Record when an item first reaches each stage."""
+        if event.item_id == "":
+            return
+        with self.lock:
+            stages = self.stages.setdefault(event.item_id, {})
+            stages.setdefault(event.stage, time.perf_counter())
+
+    def get_timings(self, item_id:str) -> dict[str,float|None]:
+        """
+        Get how long an item spent in each stage.
+
+        :param item_id:
+        Archive key of the item.
+
+        :returns timings:
+        Seconds spent downloading, converting and tagging, and in total.
+        `None` where a stage was not reached.
+        """
+        stages = self.stages.get(item_id, {})
+        start = stages.get(progress.STAGE_DOWNLOAD)
+        convert = stages.get(progress.STAGE_CONVERT)
+        end = stages.get(progress.STAGE_FINISHED) \
+            or stages.get(progress.STAGE_FAILED)
+
+        def between(first:float|None, last:float|None) -> float|None:
+            if first is None or last is None:
+                return None
+            return round(last - first, 3)
+
+        return {
+            "download": between(start, convert),
+            "process": between(convert, end),
+            "total": between(start, end)
+        }
+
+    def get_status(self, item:dict[str,typing.Any]) -> str:
+        """
+        Get the outcome of an item from the work list.
+
+        :param item:
+        Work item from `MusHappy.work_list`.
+
+        :returns status:
+        `"skipped"`, `"finished"` or `"failed"`.
+        An item listed more than once is only counted the first time.
+        """
+        if item["archived"] or item["duplicate"]:
+            return "skipped"
+        stages = self.stages.get(item["key"], {})
+        if progress.STAGE_FINISHED in stages:
+            return "finished"
+        return "failed"
+
+def read_urls(paths:list[str]) -> list[str]:
+    """
+    Read URLs from files, one per line.
+
+    :param paths:
+    Files to read, `"-"` reads from stdin.
+    Stdin is read if there are no files.
+
+    :returns urls:
+    URLs in the order they were read, blank lines and lines
+    starting with `#` are skipped.
+    """
+    if len(paths) == 0:
+        paths = ["-"]
+
+    lines = []
+    for path in paths:
+        if path == "-":
+            lines.extend(sys.stdin.read().splitlines())
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            lines.extend(f.read().splitlines())
+
+    urls = [line.strip() for line in lines]
+    return [url for url in urls if url != "" and not url.startswith("#")]
+
+def build_parser() -> argparse.ArgumentParser:
+    """Create the command line parser."""
+    parser = argparse.ArgumentParser(
+        description="Download and tag music without the UI. "
+        "A JSON summary is printed when the batch is finished."
+    )
+    parser.add_argument(
+        "files", nargs="*",
+        help="files with one URL per line, stdin is read if none are given "
+        "or for -"
+    )
+    parser.add_argument("-o", "--output", help="output directory")
+    parser.add_argument("-q", "--quiet", action="store_true",
+        help="only print warnings, errors and the summary")
+    parser.add_argument("--summary",
+        help="write the summary to this file instead of stdout")
+    parser.add_argument("--save-config", action="store_true",
+        help="keep the settings given here in the config files")
+    parser.add_argument("--resume", action="store_true",
+        help="carry on with the last interrupted job instead of "
+        "reading urls")
+
+    group = parser.add_argument_group("concurrency")
+    group.add_argument("--downloads", type=int,
+        help="URLs downloaded at the same time")
+    group.add_argument("--post-process", type=int,
+        help="URLs tagged at the same time")
+    group.add_argument("--queue-size", type=int,
+        help="downloaded URLs that may wait to be tagged")
+    group.add_argument("--prefetch", type=int,
+        help="URLs whose metadata is fetched at the same time")
+    group.add_argument("--tag-workers", type=int,
+        help="tracks tagged and saved at the same time")
+    group.add_argument("--no-archive", action="store_true",
+        help="download items even if they are in the archive")
+    group.add_argument("--profile",
+        help="name of the download profile to use")
+
+    group = parser.add_argument_group("cover art")
+    group.add_argument("--image-size", type=int,
+        help="size of the cover art in pixels")
+    group.add_argument("--ai-model",
+        help="name of the AI upscaler to use, or none")
+    group.add_argument("--interpolation", choices=list(INTERPOLATIONS),
+        help="how the cover art is scaled, none keeps its size")
+    group.add_argument("--group-cover", choices=list(GROUP_COVERS),
+        help="cover art for playlists")
+    group.add_argument("--cover-format", choices=list(image.ENCODERS),
+        help="format of the embedded cover art")
+    group.add_argument("--cover-quality", type=int,
+        help="quality of jpeg and webp cover art")
+    group.add_argument("--cover-max-bytes", type=int,
+        help="largest size of the cover art, 0 for no limit")
+    return parser
+
+def apply_arguments(task:api.MusHappy, args:argparse.Namespace) -> None:
+    """
+    Override the configuration with the command line arguments.
+
+    :param task:
+    The task to configure.
+
+    :param args:
+    Parsed command line arguments.
+    """
+    configs = task.get_config()
+    download = configs["download"]
+    formatting = configs["formatting"]
+    cover = configs["image"]
+
+    settings = [
+        (download, "output_directory", args.output),
+        (download, "max_concurrent_downloads", args.downloads),
+        (download, "max_concurrent_post_process", args.post_process),
+        (download, "pipeline_queue_size", args.queue_size),
+        (download, "max_concurrent_prefetch", args.prefetch),
+        (formatting, "max_workers", args.tag_workers),
+        (cover, "image_size_target", args.image_size),
+        (cover, "cover_format", args.cover_format),
+        (cover, "cover_quality", args.cover_quality),
+        (cover, "cover_max_bytes", args.cover_max_bytes)
+    ]
+    if args.no_archive:
+        settings.append((download, "use_archive", False))
+    if args.interpolation is not None:
+        settings.append(
+            (cover, "interpolate_method", INTERPOLATIONS[args.interpolation])
+        )
+    if args.group_cover is not None:
+        settings.append(
+            (cover, "add_image_group", GROUP_COVERS[args.group_cover])
+        )
+    if args.profile is not None:
+        names = [profile["name"].lower() for profile in download["profiles"]]
+        if args.profile.lower() not in names:
+            raise SystemExit(f"Unknown download profile {args.profile}")
+        settings.append(
+            (download, "profile", names.index(args.profile.lower()))
+        )
+    if args.ai_model is not None:
+        names = [model["name"].lower() for model in cover["ai_commands"]]
+        name = args.ai_model.lower()
+        if name == "none":
+            settings.append((cover, "ai_method", 0))
+        elif name in names:
+            # 0 is no model, the models are counted from 1
+            settings.append((cover, "ai_method", names.index(name) + 1))
+        else:
+            raise SystemExit(f"Unknown AI model {args.ai_model}")
+
+    for config, key, value in settings:
+        if value is not None:
+            config[key] = value
+
+    # png is lossless, there is no quality to lower to fit the limit
+    if cover["cover_format"] == "png" and cover["cover_max_bytes"] > 0:
+        raise SystemExit(
+            "The cover size limit needs a jpeg or webp cover format"
+        )
+
+    task.set_config(configs)
+    if args.save_config:
+        task.save_config()
+
+def summarise(
+        task:api.MusHappy,
+        logger:CliLogger,
+        elapsed:float,
+        error:Exception|None
+    ) -> dict[str,typing.Any]:
+    """
+    Build the summary of a finished batch.
+
+    :param task:
+    The task that ran the batch.
+
+    :param logger:
+    Logger that recorded the batch.
+
+    :param elapsed:
+    Seconds the batch took.
+
+    :param error:
+    Error raised by the batch, if any.
+
+    :returns summary:
+    Counts, per-item outcomes and timings, and every failure.
+    """
+    items = []
+    for item in task.work_list:
+        items.append({
+            "url": item["url"],
+            "item_url": item["item_url"],
+            "key": item["key"],
+            "title": item["title"],
+            "status": logger.get_status(item),
+            "seconds": logger.get_timings(item["key"])
+        })
+
+    statuses = [item["status"] for item in items]
+    return {
+        "elapsed": round(elapsed, 3),
+        "items": len(items),
+        "finished": statuses.count("finished"),
+        "skipped": statuses.count("skipped"),
+        "failed": statuses.count("failed"),
+        "error": None if error is None else f"{type(error).__name__}: {error}",
+        "track_errors": task.track_errors,
+        "warnings": logger.warnings,
+        "work_list": items
+    }
+
+def main() -> int:
+    """
+    Run a batch from the command line.
+
+    :returns code:
+    `0` if every item finished or was skipped, otherwise `1`.
+    """
+    args = build_parser().parse_args()
+
+    logger = CliLogger(args.quiet)
+    task = api.MusHappy()
+    task.set_logger(logger)
+    apply_arguments(task, args)
+
+    if args.resume:
+        urls = task.get_unfinished_urls()
+        if len(urls) == 0:
+            raise SystemExit("There is no interrupted job to resume")
+    else:
+        urls = read_urls(args.files)
+
+    error = None
+    start = time.perf_counter()
+    try:
+        task.download_and_tag(urls)
+    except Exception as e: #pylint: disable=W0718
+        error = e
+    summary = summarise(task, logger, time.perf_counter() - start, error)
+
+    text = json.dumps(summary, indent=4)
+    if args.summary is None:
+        print(text)
+    else:
+        with open(args.summary, "w+", encoding="utf-8") as f:
+            f.write(text)
+
+    if error is not None or summary["failed"] > 0:
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,7 +5,7 @@ import typing
 class Config:
     """Base class for the configuration managers."""
 
-    _configdir = "config\\empty.json"
+    _configdir = os.path.join("config", "empty.json")
     config = {}
 
     def __init__(self) -> None:
@@ -17,7 +17,7 @@ class Config:
             self.load()
 
         else:
-            direc = self._configdir.split('\\', maxsplit=1)[0]
+            direc = os.path.dirname(self._configdir)
             if not os.path.exists(direc):
                 os.makedirs(direc)
 
@@ -33,7 +33,9 @@ class Config:
         with open(self._configdir, "r", encoding="utf-8") as f:
             data = json.load(f)
 
-        self.config = data
+        # start from the defaults so keys added in newer versions exist
+        self.default()
+        self.config.update(data)
 
     def save(self) -> None:
         """Export current configuration to the config json file."""
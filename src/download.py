@@ -2,9 +2,36 @@ import os
 import shutil
 import typing
 import json
-import yt_dlp
+import threading
+import time
+import importlib
+import concurrent.futures
 import configure
-from handler import BaseHandler, DEBUG, INFO, WARNING, ERROR #pylint: disable=W0611
+import lazy
+import journal
+import progress
+import scheduler
+from handler import BaseHandler, is_downloaded
+from handler import DEBUG, INFO, WARNING, ERROR #pylint: disable=W0611
+
+# imported on first use, they are slow to load
+yt_dlp = lazy.LazyModule("yt_dlp")
+hooks = lazy.LazyModule("hooks")
+
+ENGINE_DOWNLOAD = "download"
+ENGINE_PREFETCH = "prefetch"
+
+# used to estimate download sizes when the site does not provide one
+ESTIMATED_BYTES_PER_SECOND = 160_000 // 8
+
+# metadata fields used by the formatters, written to the info json files
+INFO_JSON_FIELDS = [
+    "id", "extractor", "extractor_key", "title", "uploader",
+    "artists", "creator", "album", "album_artist",
+    "playlist", "playlist_title", "playlist_index", "track_number",
+    "genre", "genres", "release_year", "upload_date", "timestamp",
+    "original_url", "webpage_url"
+]
 
 class DownloadConfig(configure.Config):
     """Configuration data structure for the downloader."""
@@ -13,31 +40,309 @@ class DownloadConfig(configure.Config):
         Import configuration from the config json file if it exists,
         otherwise create one.
         """
-        self._configdir = "config\\download.json"
+        self._configdir = os.path.join("config", "download.json")
         super().__init__()
 
     def default(self) -> None:
         """Load the default configuration."""
         self.config = {
-            "output_directory": "out"
+            "output_directory": "out",
+            "max_concurrent_downloads": 3,
+            "max_concurrent_post_process": 1,
+            "pipeline_queue_size": 2,
+            "max_concurrent_prefetch": 4,
+            "use_archive": True,
+            "write_info_json": False,
+            "process_items_early": True,
+            "max_item_attempts": 2,
+            "allowed_extractors": [],
+            "max_downloads_per_host": 3,
+            "max_downloads_per_extractor": {},
+            "host_requests_per_second": 1.0,
+            "host_request_burst": 3,
+            "throttle_retries": 4,
+            "throttle_backoff": 5,
+            "throttle_backoff_max": 300,
+            "profile": 0,
+            "profiles": [{
+                "name": "Default",
+                "options": {}
+            },{
+                "name": "Gentle",
+                "options": {
+                    "concurrent_fragment_downloads": 1,
+                    "http_chunk_size": 10485760
+                }
+            },{
+                "name": "Fast",
+                "options": {
+                    "concurrent_fragment_downloads": 8,
+                    "buffersize": 1048576,
+                    "http_chunk_size": 10485760
+                }
+            },{
+                "name": "aria2c",
+                "options": {
+                    "external_downloader": {"default": "aria2c"},
+                    "external_downloader_args": {
+                        "aria2c": ["-x", "8", "-s", "8", "-k", "1M"]
+                    }
+                }
+            },{
+                "name": "Auto-tune",
+                "options": {"concurrent_fragment_downloads": 2},
+                "auto_tune": True
+            }]
         }
 
-class DownloadHandler(yt_dlp.YoutubeDL, BaseHandler):
+class PrefetchLogger:
+    """
+    Logger for metadata fetching, only warnings are passed on
+    as the other messages would be mistaken for download progress.
+    """
+    def __init__(self, handler:BaseHandler) -> None:
+        self.handler = handler
+
+    def debug(self, msg:str) -> None:
+        """debug string"""
+
+    def info(self, msg:str) -> None:
+        """info string"""
+
+    def warning(self, msg:str) -> None:
+        """warning string"""
+        self.handler.log(msg, WARNING)
+
+    def error(self, msg:str) -> None:
+        """error string"""
+        # the url is reported again if it fails to download
+        self.handler.log(msg, WARNING)
+
+class DownloadArchive:
+    """
+    Persistent record of finished downloads and where they were saved,
+    so that URLs can be downloaded again without fetching known items.
+    Each item is appended to the file as a `<key>\\t<path>` line,
+    the same idea as the yt-dlp download archive.
+    """
+    _archivedir = os.path.join("config", "archive.txt")
+
+    def __init__(self) -> None:
+        """
+        Import the archive from the file if it exists.
+        """
+        self.lock = threading.Lock()
+        self.entries:dict[str,str] = {}
+        self.load()
+
+    def load(self) -> None:
+        """
+        Import the archive from the file,
+        compacting it if items were recorded more than once.
+        """
+        if not os.path.exists(self._archivedir):
+            return
+
+        try:
+            with open(self._archivedir, "r", encoding="utf-8") as f:
+                text = f.read()
+        except OSError:
+            # a damaged archive only costs a re-download
+            self.entries = {}
+            return
+
+        lines = text.splitlines()
+        for line in lines:
+            key, tab, path = line.partition("\t")
+            if tab == "":
+                continue
+            # a later line for the same item replaces the earlier one
+            self.entries[key] = path
+
+        # a line cut short by a crash would join the next one
+        cut_short = text != "" and not text.endswith("\n")
+        if len(lines) > len(self.entries) or cut_short:
+            self.compact()
+
+    def compact(self) -> None:
+        """Rewrite the archive file with one line per item."""
+        # write a copy first so a crash cannot leave a partial archive
+        temp_path = self._archivedir + ".tmp"
+        with open(temp_path, "w+", encoding="utf-8") as f:
+            for key, path in self.entries.items():
+                f.write(f"{key}\t{path}\n")
+        os.replace(temp_path, self._archivedir)
+
+    @staticmethod
+    def get_key(info:dict[str,typing.Any]) -> str|None:
+        """
+        Get the archive key of an item, `"<extractor> <id>"`.
+
+        :param info:
+        Metadata of the item, flat playlist entries are accepted.
+
+        :returns key:
+        Archive key or `None` if the item cannot be identified.
+        """
+        extractor = info.get("extractor_key") or info.get("ie_key")
+        item_id = info.get("id")
+        if extractor is None or item_id is None:
+            return None
+        return f"{extractor.lower()} {item_id}"
+
+    def contains(self, info:dict[str,typing.Any]) -> bool:
+        """
+        Check if an item was downloaded and its file still exists.
+
+        :param info:
+        Metadata of the item.
+
+        :returns contained:
+        `True` if the item does not need downloading.
+        """
+        key = self.get_key(info)
+        with self.lock:
+            path = self.entries.get(key)
+        return path is not None and os.path.exists(path)
+
+    def add(self, info:dict[str,typing.Any], path:str) -> None:
+        """
+        Record a finished item.
+
+        :param info:
+        Metadata of the item.
+
+        :param path:
+        Final location of the audio file.
+        """
+        key = self.get_key(info)
+        if key is None:
+            return
+
+        with self.lock:
+            self.entries[key] = path
+            # only the new item is written, the file is compacted on load
+            with open(self._archivedir, "a", encoding="utf-8") as f:
+                f.write(f"{key}\t{path}\n")
+
+class FragmentTuner:
+    """
+    Finds the number of concurrent fragment downloads with the highest
+    throughput, by measuring the first few items at increasing levels
+    and keeping the best once more stops helping.
+    """
+    LEVELS = [1, 2, 4, 8, 16]
+
+    def __init__(self, start:int, samples:int=2, gain:float=1.1) -> None:
+        """
+        Finds the number of concurrent fragment downloads
+        with the highest throughput.
+
+        :param start:
+        Concurrent fragment downloads to start with.
+
+        :param samples:
+        Items measured at each level.
+
+        :param gain:
+        Throughput increase needed to keep going up a level.
+        """
+        self.lock = threading.Lock()
+        self.index = max(
+            i for i, level in enumerate(self.LEVELS)
+            if level <= max(start, 1)
+        )
+        self.samples = samples
+        self.gain = gain
+        self.measured:dict[int,list[float]] = {}
+        self.best:tuple[int,float]|None = None
+        self.settled = False
+
+    def get_level(self) -> int:
+        """Get the number of concurrent fragment downloads to use."""
+        with self.lock:
+            return self.LEVELS[self.index]
+
+    def add_sample(self, level:int, throughput:float) -> int|None:
+        """
+        Record the throughput of a finished item.
+
+        :param level:
+        Concurrent fragment downloads the item was downloaded with.
+
+        :param throughput:
+        Bytes per second.
+
+        :returns level:
+        The new level if it changed, otherwise `None`.
+        """
+        with self.lock:
+            if self.settled:
+                return None
+
+            values = self.measured.setdefault(level, [])
+            values.append(throughput)
+            if level != self.LEVELS[self.index] or len(values) < self.samples:
+                return None
+
+            average = sum(values) / len(values)
+            if self.best is None or average > self.best[1] * self.gain:
+                self.best = (level, average)
+                if self.index + 1 < len(self.LEVELS):
+                    self.index += 1
+                    return self.LEVELS[self.index]
+                self.settled = True
+                return None
+
+            # going up did not help, go back to the best level
+            self.settled = True
+            self.index = self.LEVELS.index(self.best[0])
+            return self.LEVELS[self.index]
+
+class DownloadHandler(BaseHandler):
     """Handles downloading files using yt-dlp."""
     def __init__(self) -> None:
         """Handles downloading files using yt-dlp."""
-        super().__init__()
-        self.config = DownloadConfig()
-        self.logger = None
-        self._build_opts()
+        super().__init__(DownloadConfig(), None)
+        self.config:DownloadConfig
+        # info json files are written in the background
+        self._dump_pool = concurrent.futures.ThreadPoolExecutor(1)
+        self._dumps:list[concurrent.futures.Future] = []
+
+        # idle yt-dlp instances, kept warm between urls
+        self._engine_lock = threading.Lock()
+        self._engines:dict[str,list["yt_dlp.YoutubeDL"]] = {
+            ENGINE_DOWNLOAD: [],
+            ENGINE_PREFETCH: []
+        }
+        self._engine_build_time = {
+            ENGINE_DOWNLOAD: 0.0,
+            ENGINE_PREFETCH: 0.0
+        }
 
-    def get_config(self) -> None:
-        """Get the currently used configuration."""
-        return self.config.get_config()
+        # extractor classes for the allowed extractor modules
+        self._extractor_names:list[str]|None = None
+        self._extractors:list[type] = []
+
+        self.archive = DownloadArchive()
+        self.journal = journal.Journal()
+
+        # created for profiles that auto-tune, kept until the config changes
+        self._tuner:FragmentTuner|None = None
+
+        # source of the url that downloads each item of the job,
+        # so items shared by several urls are only downloaded once
+        self._owners:dict[str,int] = {}
+
+        # per download thread, the callback for finished items
+        self._local = threading.local()
+        self._build_opts()
 
     def set_config(self, config:dict[str,typing.Any]) -> None:
         """Set the configuration."""
         self.config.set_config(config)
+        self._tuner = None
+        self.close_engines()
 
     def set_logger(self, logger:object) -> None:
         """
@@ -47,55 +352,611 @@ class DownloadHandler(yt_dlp.YoutubeDL, BaseHandler):
         class object to provide callbacks and progress updates.
         """
         self.logger = logger
+        self.close_engines()
 
-    def download_url(self, url) -> dict[str,typing.Any]:
+    def download_url(
+            self,
+            url:str,
+            on_item:typing.Callable[[dict[str,typing.Any]],None]|None=None,
+            source:int|None=None
+        ) -> dict[str,typing.Any]:
         """
         Starts the download of a song or playlist from a url.
         
         :param url:
         The url to fetch from.
 
+        :param on_item:
+        Called with the metadata of each item as soon as its audio is
+        ready. If given, the metadata of the whole url is not collected.
+
+        :param source:
+        Index of the URL in the prefetched list, items that an earlier
+        URL of the list also has are left to that URL.
+
         :returns info_clean:
-        A dictionary with all the metadata for the download task.
+        A dictionary with all the metadata for the download task,
+        empty if it failed or `on_item` was given.
         """
-        self._build_opts()
+        engine = self._acquire_engine()
+        self._local.on_item = on_item
+        self._local.engine = engine
+        self._local.source = source
         try:
-            with yt_dlp.YoutubeDL(self.opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                info_clean = ydl.sanitize_info(info)
-                with open("down\\data.json", "w+", encoding="utf-8") as f:
-                    json.dump(info_clean, f, indent=4)
-        except yt_dlp.DownloadError:
+            info = engine.extract_info(url, download=True)
+            if on_item is None:
+                info_clean = engine.sanitize_info(info)
+                if self.config.get_value("write_info_json"):
+                    self._dump_info(info_clean)
+            else:
+                info_clean = {}
+        except yt_dlp.DownloadError as e:
+            # the scheduler backs off and tries again
+            if scheduler.is_throttled(e):
+                raise
             info_clean = {}
+        finally:
+            self._local.on_item = None
+            self._local.engine = None
+            self._local.source = None
+            self._release_engine(engine)
 
         return info_clean
 
+    def _item_finished(self, info:dict[str,typing.Any]) -> None:
+        """
+        Called by yt-dlp when an item has been downloaded and converted,
+        records it in the journal and passes it to the callback
+        of the running download.
+
+        :param info:
+        Metadata of the item.
+        """
+        self.journal.set_state(
+            DownloadArchive.get_key(info),
+            journal.ITEM_DOWNLOADED,
+            info["filepath"]
+        )
+
+        on_item = getattr(self._local, "on_item", None)
+        if on_item is None:
+            return
+
+        meta = yt_dlp.YoutubeDL.sanitize_info(info)
+        meta["_type"] = "video"
+        meta["requested_downloads"] = [{
+            "filepath": info["filepath"],
+            "__finaldir": info.get("__finaldir")
+                or os.path.dirname(info["filepath"])
+        }]
+
+        if self.config.get_value("write_info_json"):
+            self._dump_info(meta)
+        on_item(meta)
+
+    def prefetch(self, url_list:list[str]) -> list[dict[str,typing.Any]]:
+        """
+        Fetch the metadata of all the URLs without downloading any media.
+        Playlists are expanded into their items.
+
+        :param url_list:
+        The list of URLs as strings to be downloaded.
+
+        :returns work_list:
+        One dictionary per item, in the order they will be downloaded.
+        `"source"` is the index of the URL the item came from,
+        `"duplicate"` is `True` if an earlier item has the same key.
+        """
+        workers = max(1, int(self.config.get_value("max_concurrent_prefetch")))
+        self.log("[download] Fetching metadata", INFO)
+
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            plans = pool.map(self._prefetch_url, range(len(url_list)), url_list)
+            work_list = [item for plan in plans for item in plan]
+
+        # the first url with an item downloads it
+        owners = {}
+        for item in work_list:
+            key = item["key"]
+            item["duplicate"] = key is not None and key in owners
+            if key is not None and not item["duplicate"]:
+                owners[key] = item["source"]
+        self._owners = owners
+
+        return work_list
+
+    def _prefetch_url(
+            self,
+            source:int,
+            url:str
+        ) -> list[dict[str,typing.Any]]:
+        """
+        Fetch the metadata of a single URL without downloading media.
+
+        :param source:
+        Index of the URL in the list.
+
+        :param url:
+        The url to fetch from.
+
+        :returns work_list:
+        Work items of the URL, a failed URL has one item so it is retried
+        and reported by the download.
+        """
+        engine = self._acquire_engine(ENGINE_PREFETCH)
+        try:
+            info = engine.extract_info(url, download=False)
+        except yt_dlp.DownloadError:
+            info = None
+        except Exception as e: #pylint: disable=W0718
+            # the download reports the url again if it still fails
+            self.log(
+                f"[download] Could not fetch metadata of {url}: {e}",
+                WARNING
+            )
+            info = None
+        finally:
+            self._release_engine(engine, ENGINE_PREFETCH)
+
+        if info is None:
+            return [self._work_item(source, url, {"webpage_url": url})]
+
+        if info.get("_type") == "playlist":
+            entries = [e for e in info.get("entries") or [] if e is not None]
+            return [self._work_item(source, url, e, info) for e in entries]
+
+        return [self._work_item(source, url, info)]
+
+    def _work_item(
+            self,
+            source:int,
+            url:str,
+            entry:dict[str,typing.Any],
+            playlist:dict[str,typing.Any]|None=None
+        ) -> dict[str,typing.Any]:
+        """
+        Summarise the prefetched metadata of an item.
+
+        :param source:
+        Index of the URL in the list.
+
+        :param url:
+        The URL the item came from.
+
+        :param entry:
+        Full or flat metadata of the item.
+
+        :param playlist:
+        Metadata of the playlist containing the item, if any.
+
+        :returns item:
+        Work item dictionary.
+        """
+        duration = entry.get("duration") or 0
+        size = entry.get("filesize") or entry.get("filesize_approx")
+        if size is None:
+            size = int(duration * ESTIMATED_BYTES_PER_SECOND)
+
+        archived = self._is_finished(entry)
+
+        return {
+            "source": source,
+            "url": url,
+            "item_url": entry.get("webpage_url") or entry.get("url") or url,
+            "key": DownloadArchive.get_key(entry),
+            "extractor": entry.get("extractor_key") or entry.get("ie_key"),
+            "title": entry.get("title"),
+            "duration": duration,
+            "filesize_approx": size,
+            "playlist": playlist.get("title") if playlist else None,
+            "archived": archived
+        }
+
+    def _dump_info(self, info_clean:dict[str,typing.Any]) -> None:
+        """
+        Queue a compact json file of each downloaded item,
+        only the fields used by the formatters are kept.
+
+        :param info_clean:
+        A dictionary with all the metadata for the download task.
+        """
+        if info_clean["_type"] == "playlist":
+            entries = info_clean["entries"]
+        else:
+            entries = [info_clean]
+
+        for entry in entries:
+            if not is_downloaded(entry):
+                continue
+
+            compact = {k: entry[k] for k in INFO_JSON_FIELDS if k in entry}
+            compact["filepath"] = entry["requested_downloads"][0]["filepath"]
+            if len(entry.get("thumbnails") or []) > 0:
+                compact["thumbnail"] = entry["thumbnails"][-1].get("filepath")
+
+            name = f"{entry.get('extractor')}-{entry.get('id')}.json"
+            path = os.path.join(os.path.abspath("down"), name)
+            self._dumps.append(
+                self._dump_pool.submit(self._write_json, path, compact)
+            )
+
+    @staticmethod
+    def _write_json(path:str, data:dict[str,typing.Any]) -> None:
+        """
+        Write a dictionary to a compact json file.
+
+        :param path:
+        File to write.
+
+        :param data:
+        Dictionary to write.
+        """
+        with open(path, "w+", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+
+    def record(self, info:dict[str,typing.Any], path:str) -> None:
+        """
+        Add a finished item to the download archive.
+
+        :param info:
+        Metadata of the item.
+
+        :param path:
+        Final location of the audio file.
+        """
+        self.archive.add(info, path)
+
+    def get_output_directory(self) -> str:
+        """
+        Get the output directory, creating it if needed.
+
+        :returns dest_path:
+        Absolute path of the output directory.
+        """
+        dest_path = os.path.abspath(self.config.get_value("output_directory"))
+        if not os.path.exists(dest_path):
+            os.makedirs(dest_path, exist_ok=True)
+        return dest_path
+
+    def _match_archive(
+            self,
+            info:dict[str,typing.Any],
+            incomplete:bool=False #pylint: disable=W0613
+        ) -> str|None:
+        """
+        Filter for yt-dlp, skip items that are in the archive,
+        were finalized before the job was interrupted,
+        or are downloaded by an earlier URL of the job.
+        Playlist entries are checked before their media is fetched.
+
+        :returns reason:
+        Message explaining the skip, or `None` to download the item.
+        """
+        title = info.get("title") or info.get("id")
+        if self._is_finished(info):
+            return f"{title} has already been downloaded"
+
+        owner = self._owners.get(DownloadArchive.get_key(info))
+        source = getattr(self._local, "source", None)
+        if owner is not None and source is not None and owner != source:
+            return f"{title} is downloaded by another URL"
+        return None
+
+    def _is_finished(self, info:dict[str,typing.Any]) -> bool:
+        """
+        Check if an item does not need downloading.
+
+        :param info:
+        Metadata of the item.
+
+        :returns finished:
+        `True` if the item is in the archive, or finalized or given up on
+        in the journal of the current job.
+        """
+        if self.config.get_value("use_archive") and self.archive.contains(info):
+            return True
+        key = DownloadArchive.get_key(info)
+        return self.journal.is_settled(key)
+
+    def _acquire_engine(self, kind:str=ENGINE_DOWNLOAD) -> "yt_dlp.YoutubeDL":
+        """
+        Take an idle yt-dlp instance, or create one if all are in use.
+        An instance is only ever used by one download at a time.
+
+        :param kind:
+        `ENGINE_DOWNLOAD` or `ENGINE_PREFETCH`
+
+        :returns engine:
+        Configured :class:`yt_dlp.YoutubeDL`
+        """
+        tuner = self._get_tuner() if kind == ENGINE_DOWNLOAD else None
+        with self._engine_lock:
+            if len(self._engines[kind]) > 0:
+                engine = self._engines[kind].pop()
+                self.log(
+                    f"[download] Reusing warm {kind} engine, saved "
+                    f"{self._engine_build_time[kind]:.2f}s",
+                    DEBUG
+                )
+                if tuner is not None:
+                    engine.params["concurrent_fragment_downloads"] = \
+                        tuner.get_level()
+                return engine
+
+        start = time.perf_counter()
+        if kind == ENGINE_PREFETCH:
+            opts = self._build_prefetch_opts()
+        else:
+            self._build_opts()
+            opts = self.opts
+        extractors = self.load_extractors()
+        if len(extractors) == 0:
+            engine = yt_dlp.YoutubeDL(opts)
+        else:
+            # only match urls against the allowed sites
+            engine = yt_dlp.YoutubeDL(opts, auto_init=False)
+            for extractor in extractors:
+                # an instance, a class makes yt-dlp look the extractor
+                # up again among all of them on the first url
+                engine.add_info_extractor(extractor())
+        if kind == ENGINE_DOWNLOAD:
+            engine.add_post_processor(
+                hooks.ItemPostProcessor(self._item_finished),
+                when="after_move"
+            )
+        if tuner is not None:
+            engine.params["concurrent_fragment_downloads"] = tuner.get_level()
+        self._engine_build_time[kind] = time.perf_counter() - start
+        self.log(
+            f"[download] Started {kind} engine in "
+            f"{self._engine_build_time[kind]:.2f}s",
+            DEBUG
+        )
+        return engine
+
+    def _progress_hook(self, status:dict[str,typing.Any]) -> None:
+        """
+        Called by yt-dlp while an item downloads.
+
+        :param status:
+        Download status from yt-dlp.
+        """
+        if status["status"] not in ["downloading", "finished"]:
+            return
+        info = status.get("info_dict") or {}
+        if status["status"] == "finished":
+            self._tune(status)
+        self.report(progress.ProgressEvent(
+            DownloadArchive.get_key(info) or "",
+            progress.STAGE_DOWNLOAD,
+            title=info.get("title") or "",
+            bytes_done=status.get("downloaded_bytes") or 0,
+            bytes_total=status.get("total_bytes")
+                or status.get("total_bytes_estimate"),
+            speed=status.get("speed"),
+            eta=status.get("eta")
+        ))
+
+    def _tune(self, status:dict[str,typing.Any]) -> None:
+        """
+        Measure a finished download for the auto-tune profile
+        and adjust the fragment downloads of this thread's engine.
+
+        :param status:
+        Download status from yt-dlp.
+        """
+        tuner = self._get_tuner()
+        engine = getattr(self._local, "engine", None)
+        elapsed = status.get("elapsed") or 0
+        size = status.get("downloaded_bytes") or status.get("total_bytes")
+        if tuner is None or engine is None or elapsed <= 0 or not size:
+            return
+
+        level = engine.params.get("concurrent_fragment_downloads") or 1
+        new_level = tuner.add_sample(level, size / elapsed)
+        if new_level is not None:
+            # read by yt-dlp when the next item starts downloading
+            engine.params["concurrent_fragment_downloads"] = new_level
+            self.log(
+                f"[download] Auto-tune: {new_level} concurrent fragments, "
+                f"measured {size / elapsed / 1e6:.2f} MB/s at {level}",
+                INFO
+            )
+
+    def get_profile(self) -> dict[str,typing.Any]:
+        """
+        Get the selected download profile.
+
+        :returns profile:
+        `{"name": str, "options": dict}`, with `"auto_tune": True`
+        to adjust the fragment downloads while downloading.
+        """
+        profiles = self.config.get_value("profiles") or []
+        index = int(self.config.get_value("profile"))
+        if 0 <= index < len(profiles):
+            return profiles[index]
+        return {"name": "Default", "options": {}}
+
+    def get_profile_names(self) -> list[str]:
+        """Get the names of the download profiles."""
+        profiles = self.config.get_value("profiles") or []
+        return [profile["name"] for profile in profiles]
+
+    def _get_tuner(self) -> FragmentTuner|None:
+        """
+        Get the tuner of the auto-tune profile.
+
+        :returns tuner:
+        The tuner, or `None` if the selected profile does not auto-tune.
+        """
+        profile = self.get_profile()
+        if not profile.get("auto_tune"):
+            return None
+
+        with self._engine_lock:
+            if self._tuner is None:
+                start = profile["options"].get("concurrent_fragment_downloads")
+                self._tuner = FragmentTuner(start or 1)
+            return self._tuner
+
+    def _postprocessor_hook(self, status:dict[str,typing.Any]) -> None:
+        """
+        Called by yt-dlp while an item is converted.
+
+        :param status:
+        Post processing status from yt-dlp.
+        """
+        if status["status"] != "started":
+            return
+        info = status.get("info_dict") or {}
+        self.report(progress.ProgressEvent(
+            DownloadArchive.get_key(info) or "",
+            progress.STAGE_CONVERT,
+            title=info.get("title") or ""
+        ))
+
+    def _release_engine(
+            self,
+            engine:"yt_dlp.YoutubeDL",
+            kind:str=ENGINE_DOWNLOAD
+        ) -> None:
+        """
+        Return a yt-dlp instance so the next url can use it.
+
+        :param engine:
+        Instance taken with `_acquire_engine`.
+
+        :param kind:
+        `ENGINE_DOWNLOAD` or `ENGINE_PREFETCH`
+        """
+        with self._engine_lock:
+            self._engines[kind].append(engine)
+
+    def load_extractors(self) -> list[type]:
+        """
+        Import the extractor modules listed in `"allowed_extractors"`,
+        such as `"youtube"` for `yt_dlp.extractor.youtube`.
+
+        :returns extractors:
+        Extractor classes of the allowed modules that can match URLs,
+        empty if every extractor is allowed.
+        """
+        names = list(self.config.get_value("allowed_extractors"))
+        with self._engine_lock:
+            if names == self._extractor_names:
+                return self._extractors
+
+        extractors = []
+        for name in names:
+            try:
+                module = importlib.import_module(f"yt_dlp.extractor.{name}")
+            except ImportError:
+                self.log(f"[download] Unknown extractor module {name}", WARNING)
+                continue
+
+            # keep the order they are defined in, the first match is used
+            for value in vars(module).values():
+                if isinstance(value, type) \
+                        and value.__module__ == module.__name__ \
+                        and value.__name__.endswith("IE") \
+                        and hasattr(value, "ie_key") \
+                        and self._is_usable_extractor(value):
+                    extractors.append(value)
+
+        if len(names) > 0 and len(extractors) == 0:
+            self.log(
+                "[download] No allowed extractors found, using all of them",
+                WARNING
+            )
+
+        with self._engine_lock:
+            self._extractor_names = names
+            self._extractors = extractors
+        return extractors
+
+    @staticmethod
+    def _is_usable_extractor(extractor:type) -> bool:
+        """
+        Check an extractor class can match URLs, base classes shared by
+        the extractors of a site have no `_VALID_URL` and cannot.
+
+        :param extractor:
+        Extractor class from an extractor module.
+
+        :returns usable:
+        `True` if the extractor has a URL pattern and is enabled.
+        """
+        if not getattr(extractor, "_VALID_URL", None):
+            return False
+        return getattr(extractor, "_ENABLED", True) is not False
+
+    def close_engines(self) -> None:
+        """
+        Close the idle yt-dlp instances,
+        new ones are created with the current options when needed.
+        """
+        with self._engine_lock:
+            engines = [e for pool in self._engines.values() for e in pool]
+            for pool in self._engines.values():
+                pool.clear()
+
+        for engine in engines:
+            engine.close()
+
     def _build_opts(self) -> None:
-        """Create the configuration dictionary for yt-dlp."""
+        """
+        Create the configuration dictionary for yt-dlp,
+        starting from the options of the selected profile.
+        """
         # Extract audio using ffmpeg
         postprocessor = {
             "key": "FFmpegExtractAudio",
             "preferredcodec": "mp3",
         }
-        self.opts = {
+        # the options the pipeline relies on take priority
+        self.opts = self.get_profile()["options"] | {
             "format": "mp3/bestaudio/best",
             "outtmpl": {
-                "default": os.getcwd()
-                + "\\down\\%(extractor)s-%(id)s-%(title)s.%(ext)s"
+                "default": os.path.join(
+                    os.getcwd(),
+                    "down",
+                    "%(extractor)s-%(id)s-%(title)s.%(ext)s"
+                )
             },
             "restrictfilenames": True,
+            # files converted before an interruption are not downloaded
+            # again, partly downloaded files carry on from where they were
+            "final_ext": "mp3",
+            "continuedl": True,
             "writethumbnail": True,
             "clean_infojson": True,
             "logger": self.logger,
-            "postprocessors": [postprocessor]
+            "postprocessors": [postprocessor],
+            # progress is reported through the hooks, not log lines
+            "noprogress": True,
+            "no_color": True,
+            "progress_hooks": [self._progress_hook],
+            "postprocessor_hooks": [self._postprocessor_hook]
         }
+        self.opts["match_filter"] = self._match_archive
 
-    def save_config(self) -> None:
-        """Save changes to the download configuration."""
-        self.config.save()
+    def _build_prefetch_opts(self) -> dict[str,typing.Any]:
+        """
+        Create the configuration dictionary for yt-dlp
+        to fetch metadata only.
+
+        :returns opts:
+        Options for :class:`yt_dlp.YoutubeDL`
+        """
+        return {
+            "format": "mp3/bestaudio/best",
+            "extract_flat": "in_playlist",
+            "skip_download": True,
+            "logger": PrefetchLogger(self)
+        }
 
     def clean(self) -> None:
-        """Move files to final location and remove temporary files."""
+        """Move leftover files to final location and remove temporary files."""
         src_path = os.path.abspath("down")
         if not os.path.exists(src_path):
             self.log(
@@ -105,12 +966,14 @@ class DownloadHandler(yt_dlp.YoutubeDL, BaseHandler):
             return
 
         self.log("[download] Cleaning up", INFO)
-        src_files = os.listdir(src_path)
-        dest_path = self.config.get_value("output_directory")
+        concurrent.futures.wait(self._dumps)
+        self._dumps = []
 
-        if not os.path.exists(dest_path):
-            os.mkdir(dest_path)
+        src_files = os.listdir(src_path)
+        dest_path = self.get_output_directory()
 
+        # tracks are finalized as they are tagged,
+        # only tracks that failed to finalize are left here
         for file in src_files:
             if file.endswith('.mp3'):
                 shutil.move(
@@ -1,15 +1,22 @@
 import os
 import re
+import errno
+import shutil
 import time
 import typing
-import eyed3
-from eyed3.id3.frames import ImageFrame
+import mimetypes
+import concurrent.futures
 import configure
+import lazy
 from handler import BaseHandler, DEBUG, INFO, WARNING, ERROR #pylint: disable=W0611
 
+# imported on first use, they are slow to load
+eyed3 = lazy.LazyModule("eyed3")
+frames = lazy.LazyModule("eyed3.id3.frames")
+
 class FormatConfig(configure.Config):
     """Configuration data structure for the formatters."""
-    _configdir = "config\\format.json"
+    _configdir = os.path.join("config", "format.json")
 
     def __init__(self) -> None:
         super().__init__()
@@ -19,7 +26,9 @@ class FormatConfig(configure.Config):
         """Load the default configuration."""
         self.config = {
             # keep all until the first non-ASCII character
-            "title_regex": r"[^\x00-\x7F].*"
+            "title_regex": r"[^\x00-\x7F].*",
+            # number of tracks tagged and saved at the same time
+            "max_workers": 4
         }
 
 class MusicFormatHandler(BaseHandler):
@@ -36,6 +45,10 @@ class MusicFormatHandler(BaseHandler):
         self.config:FormatConfig
         self.formatters:list[MusicFormatter]
 
+        # tracks that failed a step, and why
+        self.failed:set[MusicFormatter] = set()
+        self.errors:list[dict[str,str]] = []
+
     def get_config(self) -> None:
         """Get the currently used configuration."""
         return self.config.get_config()
@@ -53,37 +66,130 @@ class MusicFormatHandler(BaseHandler):
         """
         self.logger = logger
 
-    # The following works, but it feels repetitive and wrong.
-    # I am almost certain there exists a better way to do this,
-    # but I have no idea where to even begin looking for it.
+    def set_info(self, info:dict[str:typing.Any]) -> None:
+        """Pass in the metadata to be used in the subclasses."""
+        super().set_info(info)
+        self.failed = set()
+        self.errors = []
 
-    # "this" being a wrapper class that calls the methods of
-    # another class from a list of class objects in the wrapper class.
+    def process(
+            self,
+            images:list|None,
+            mime:str,
+            dest_path:str,
+            on_step:typing.Callable[["MusicFormatter",str],None]|None=None
+        ) -> None:
+        """
+        Tag, save and finalize each track from start to finish,
+        releasing it before the next. At most `max_workers` music files
+        are open at once, however long the playlist.
 
-    def correct_metadata(self) -> None:
-        """Correct the metadata."""
-        for inst in self.formatters:
-            inst.correct_metadata()
+        :param images:
+        Encoded image or image path per formatter, `None` to leave
+        the cover to `attach_covers`.
 
-    def tag_audio(self) -> None:
-        """Attach the metadata to the files."""
-        for inst in self.formatters:
-            inst.tag_audio()
+        :param mime:
+        Mime type of the encoded images.
 
-    def tag_image(self, images:list) -> None:
-        """Attach the appropriate images."""
-        for i, inst in enumerate(self.formatters):
-            inst.tag_image(images[i])
+        :param dest_path:
+        Output directory.
 
-    def save(self) -> None:
-        """Save changes to the audio files."""
-        for inst in self.formatters:
-            inst.save()
+        :param on_step:
+        Called with a track and `"saved"` once its tags are written,
+        then with `"finalized"` once it is in the output directory.
+        """
+        def _process(i:int, inst:MusicFormatter) -> None:
+            try:
+                inst.correct_metadata()
+                inst.tag_audio()
+                if images is not None:
+                    inst.tag_image(images[i], mime)
+                inst.save()
+                if on_step is not None:
+                    on_step(inst, "saved")
+                inst.finalize(dest_path)
+                if on_step is not None:
+                    on_step(inst, "finalized")
+            finally:
+                inst.release()
+
+        self._run_each("process", _process)
+
+    def attach_covers(
+            self,
+            images:list,
+            mime:str,
+            on_step:typing.Callable[["MusicFormatter",str],None]|None=None
+        ) -> None:
+        """
+        Attach covers to tracks that are already in the output directory.
 
-    def rename(self) -> None:
-        """Rename the audio files."""
-        for inst in self.formatters:
-            inst.rename()
+        :param images:
+        Encoded image or image path per formatter.
+
+        :param mime:
+        Mime type of the encoded images.
+
+        :param on_step:
+        Called with a track and `"finalized"` once its cover is saved.
+        """
+        def _attach(i:int, inst:MusicFormatter) -> None:
+            try:
+                inst.tag_image(images[i], mime)
+                inst.save()
+                if on_step is not None:
+                    on_step(inst, "finalized")
+            finally:
+                inst.release()
+
+        self._run_each("attach cover to", _attach)
+
+    def _run_each(
+            self,
+            step:str,
+            action:typing.Callable[[int,"MusicFormatter"],None]
+        ) -> None:
+        """
+        Run a step for every formatter on a thread pool.
+        A formatter that fails is logged and skipped by the later steps,
+        the others carry on.
+
+        :param step:
+        Name of the step for the error log.
+
+        :param action:
+        Called with the index and the formatter.
+        """
+        def _run(i:int, inst:MusicFormatter) -> Exception|None:
+            if inst in self.failed:
+                return None
+            try:
+                action(i, inst)
+            except Exception as e: #pylint: disable=W0718
+                return e
+            return None
+
+        workers = max(1, int(self.config.get_value("max_workers")))
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            results = list(pool.map(
+                _run,
+                range(len(self.formatters)),
+                self.formatters
+            ))
+
+        for inst, error in zip(self.formatters, results):
+            if error is None:
+                continue
+            self.failed.add(inst)
+            self.errors.append({
+                "path": inst.get_music_path(),
+                "step": step,
+                "error": f"{type(error).__name__}: {error}"
+            })
+            self.log(
+                f"[music] Failed to {step} {inst.get_music_path()}: {error}",
+                WARNING
+            )
 
 class MusicFormatter:
     """
@@ -103,9 +209,25 @@ class MusicFormatter:
         self.meta = metadata
         self.config = config
         self.handler = handler
-        self.audio = self._load_music()
+        # opened when first needed, see `get_audio`
+        self.audio:"eyed3.AudioFile|None" = None
+
+    def get_audio(self) -> "eyed3.AudioFile":
+        """
+        Get the music file, opening it if needed.
+
+        :returns audio:
+        :class:`eyed3.AudioFile`
+        """
+        if self.audio is None:
+            self.audio = self._load_music()
+        return self.audio
+
+    def release(self) -> None:
+        """Close the music file, freeing the parsed tags."""
+        self.audio = None
 
-    def _load_music(self) -> eyed3.AudioFile:
+    def _load_music(self) -> "eyed3.AudioFile":
         """
         Open the music file and initialise tagging.
 
@@ -151,14 +273,15 @@ class MusicFormatter:
             f"[music] Tagging metadata for {self._get_title()}",
             INFO
         )
-        self.audio.tag.title            = self._get_title()
-        self.audio.tag.artist           = self._get_artists()
-        self.audio.tag.album_artist     = self._get_album_artist()
-        self.audio.tag.album            = self._get_album()
-        self.audio.tag.recording_date   = self._get_date()
-        self.audio.tag.genre            = self._get_genres()
-        self.audio.tag.track_num        = self._get_track_num()
-        self.audio.tag.audio_source_url = self._get_source()
+        tag = self.get_audio().tag
+        tag.title            = self._get_title()
+        tag.artist           = self._get_artists()
+        tag.album_artist     = self._get_album_artist()
+        tag.album            = self._get_album()
+        tag.recording_date   = self._get_date()
+        tag.genre            = self._get_genres()
+        tag.track_num        = self._get_track_num()
+        tag.audio_source_url = self._get_source()
 
     def _try_key(self, key:str) -> typing.Any:
         """
@@ -329,42 +452,90 @@ class MusicFormatter:
         # failed to get source url
         return ""
 
-    def tag_image(self, image_path:str) -> None:
+    def tag_image(self, image:bytes|str|None, mime:str="image/png") -> None:
         """
         Attach image to audio file.
 
-        :param image_path:
-        Directory of the image to attach.
+        :param image:
+        Encoded image, or directory of the image to attach.
+
+        :param mime:
+        Mime type of an encoded image, paths are guessed from the name.
         """
-        with open(image_path, 'rb') as f:
-            self.audio.tag.images.set(
-                ImageFrame.FRONT_COVER,
-                f.read(),
-                'images/jpeg'
+        if image is None:
+            self.handler.log(
+                f"[music] No cover art for {self._get_title()}",
+                WARNING
             )
+            return
+
+        if isinstance(image, str):
+            mime = mimetypes.guess_type(image)[0] or mime
+            with open(image, 'rb') as f:
+                image = f.read()
+
+        self.get_audio().tag.images.set(
+            frames.ImageFrame.FRONT_COVER,
+            image,
+            mime
+        )
 
     def save(self) -> None:
         """Save changes to the audio file."""
-        self.audio.tag.save()
+        self.get_audio().tag.save()
 
-    def rename(self) -> None:
-        """Rename the audio file."""
-        old_path = self.get_music_path()
-        cwd, _ = os.path.split(old_path)
-        _, ext = os.path.splitext(old_path)
+    def get_final_name(self) -> str:
+        """
+        Get the file name of the tagged audio file.
 
-        new_name = \
+        :returns name:
+        `"<artists> - <title>.<ext>"`
+        """
+        _, ext = os.path.splitext(self.get_music_path())
+        return \
             self._get_artists() \
             + " - " \
             + self._get_title() \
             + ext
-        new_path = os.path.join(cwd, new_name)
+
+    def rename(self) -> None:
+        """Rename the audio file."""
+        old_path = self.get_music_path()
+        cwd, _ = os.path.split(old_path)
+        new_path = os.path.join(cwd, self.get_final_name())
 
         if os.path.exists(new_path):
             os.remove(new_path)
 
         try:
             os.rename(old_path, new_path)
+            self.meta["requested_downloads"][0]["filepath"] = new_path
         except OSError as e:
             self.handler.log(f"[error] {old_path} -X-> {new_path}", ERROR)
             print(e)
+
+    def finalize(self, dest_path:str) -> None:
+        """
+        Move the tagged audio file to its final name in the output folder.
+        The final path only ever holds a complete file.
+
+        :param dest_path:
+        Output directory.
+        """
+        old_path = self.get_music_path()
+        new_path = os.path.join(dest_path, self.get_final_name())
+
+        try:
+            # atomic when on the same filesystem
+            os.replace(old_path, new_path)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            # copy next to the final path first, then swap it in
+            temp_path = new_path + ".part"
+            shutil.copyfile(old_path, temp_path)
+            os.replace(temp_path, new_path)
+            os.remove(old_path)
+
+        self.meta["requested_downloads"][0]["filepath"] = new_path
+        self.handler.log(f"[music] Saved {new_path}", INFO)
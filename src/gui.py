@@ -1,6 +1,5 @@
 import sys
 import os
-import re
 import json
 import typing
 import ctypes
@@ -48,6 +47,7 @@ COVER_ATTACH_GROUP = [
 class DownloadUI(QWidget):
     """Main application."""
     progress_changed = Signal(str, dict)
+    ai_models_found = Signal(list)
 
     def __init__(self, task:QThread) -> None:
         super().__init__()
@@ -62,12 +62,15 @@ class DownloadUI(QWidget):
         self.label_updates:QLabel = None
 
         self.widgets = []
+        # probed in the background once the window is shown
+        self.ai_models:list[str]|None = None
 
         icon = QIcon(ICON_DIR)
         self.setWindowIcon(icon)
         self.setWindowTitle(TITLE)
         self.build()
         self.progress_changed.connect(self.update_progress)
+        self.ai_models_found.connect(self.set_ai_models)
         self.resize(WIDTH, HEIGHT)
         self.text_edit.setFocus()
 
@@ -241,9 +244,8 @@ Most common - Use the most common image for all the
             ("image", "image_size_target")
         )
 
+        # the models are added by `set_ai_models`
         ai_method = ["None"]
-        if self.task is not None:
-            ai_method.extend(self.task.get_valid_ai_models())
         combo_ai_method = QComboBox()
         combo_ai_method.addItems(ai_method)
         combo_ai_method.currentIndexChanged.connect(
@@ -308,6 +310,30 @@ Most common - Use the most common image for all the
 
         self.label_updates = QLabel()
 
+        profiles = []
+        if self.task is not None:
+            profiles = self.task.get_download_profiles()
+        combo_profile = QComboBox()
+        combo_profile.addItems(profiles)
+        combo_profile.setToolTip(
+            """Select how yt-dlp downloads, profiles are edited in
+config\\download.json. Auto-tune measures the first few
+downloads to find the fastest fragment concurrency."""
+        )
+        combo_profile.currentIndexChanged.connect(
+            lambda: self.update_content(combo_profile)
+        )
+        self._add_active_widget(
+            combo_profile,
+            "combo",
+            "download",
+            ("download", "profile"),
+            profiles
+        )
+
+        form = QFormLayout()
+        form.addRow(self.tr("&Profile:"), combo_profile)
+
         self.button_down = QPushButton("Start")
         self.button_down.setObjectName("accent")
         self.button_down.clicked.connect(self.run_task)
@@ -320,6 +346,7 @@ Most common - Use the most common image for all the
 
         layout = QVBoxLayout()
         layout.addWidget(title)
+        layout.addLayout(form)
         layout.addWidget(self.bar_partial)
         layout.addWidget(self.bar_total)
         layout.addWidget(self.label_updates)
@@ -418,15 +445,28 @@ Most common - Use the most common image for all the
                 case "combo":
                     widget:QComboBox
                     if dl == ("image", "ai_method"):
-                        for _ in data["image"]["ai_commands"]:
-                            widget.removeItem(1)
-                        items = self.task.get_valid_ai_models()
-                        widget.addItems(items)
+                        self._fill_ai_models(widget, int(d))
+                        continue
                     widget.setCurrentIndex(int(d))
                 case "spin":
                     widget:QSpinBox
                     widget.setValue(int(d))
 
+    def set_ai_models(self, models:list[str]) -> None:
+        """Show the AI models found by the background loader."""
+        self.ai_models = models
+        self.update_widgets()
+
+    def _fill_ai_models(self, widget:QComboBox, index:int) -> None:
+        """Refill the AI model combo box without changing the config."""
+        widget.blockSignals(True)
+        widget.clear()
+        widget.addItems(["None"] + (self.ai_models or []))
+        # the selected model is kept until the models are known
+        if self.ai_models is not None:
+            widget.setCurrentIndex(index)
+        widget.blockSignals(False)
+
     def run_task(self) -> None:
         """Final checks and run task."""
         # check a task exists
@@ -445,6 +485,18 @@ Most common - Use the most common image for all the
         self.task.set_urls(urls)
         self.task.start()
 
+    def offer_resume(self) -> None:
+        """Fill in the URLs of an interrupted download, if there is one."""
+        if self.task is None:
+            return
+
+        urls = self.task.get_unfinished_urls()
+        if len(urls) == 0 or self.text_edit.toPlainText() != "":
+            return
+
+        self.text_edit.setPlainText("\n".join(urls))
+        self.label_updates.setText("Download to resume")
+
     def _get_urls(self) -> list[str]:
         """get url list from th UI."""
         text = self.text_edit.toPlainText()
@@ -461,10 +513,7 @@ Most common - Use the most common image for all the
         self.bar_partial.setValue(data["partial"])
         self.bar_total.setValue(data["total"])
 
-        # remove ansi escape sequences
-        msg = re.sub(r"\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])", '', msg)
-        # remove "[...]" prefix (and other)
-        msg = re.sub(r"\[.*?\]", "", msg)
+        msg = data["status"]
 
         max_len = 40
         if len(msg) > max_len:
@@ -1,3 +1,4 @@
+import copy
 import typing
 
 DEBUG = 0
@@ -57,12 +58,57 @@ class BaseHandler:
             elif level == ERROR:
                 self.logger.error(message)
 
+    def report(self, event:object) -> None:
+        """
+        Send a progress event through the logger,
+        if the logger accepts them.
+
+        :param event:
+        :class:`progress.ProgressEvent` to pass through the logger.
+        """
+        if self.logger is not None and hasattr(self.logger, "progress"):
+            self.logger.progress(event)
+
+    def spawn(self) -> "BaseHandler":
+        """
+        Create a handler that shares the configuration and logger,
+        but keeps its own metadata and formatters.
+        Used to process several URLs at the same time.
+
+        :returns handler:
+        New handler of the same type.
+        """
+        handler = copy.copy(self)
+        handler.info = {}
+        handler.formatters = []
+        return handler
+
     def set_info(self, info:dict[str:typing.Any]) -> None:
         """Pass in the metadata to be used in the subclasses."""
         self.info = info
         self.formatters = []
         if info["_type"] == "playlist":
-            for meta in self.info["entries"]:
-                self.formatters.append(self.child(meta, self.config, self))
+            entries = self.info["entries"]
         else:
-            self.formatters.append(self.child(info, self.config, self))
+            entries = [info]
+
+        for meta in entries:
+            # skipped items, such as those already in the archive,
+            # are listed without a downloaded file
+            if not is_downloaded(meta):
+                continue
+            self.formatters.append(self.child(meta, self.config, self))
+
+def is_downloaded(meta:dict[str,typing.Any]|None) -> bool:
+    """
+    Check if an item from yt-dlp has a downloaded file.
+
+    :param meta:
+    Metadata of the item.
+
+    :returns downloaded:
+    `True` if the item has a file to work with.
+    """
+    if meta is None or "requested_downloads" not in meta:
+        return False
+    return "filepath" in meta["requested_downloads"][0]
@@ -0,0 +1,33 @@
+import typing
+from yt_dlp.postprocessor import PostProcessor
+
+class ItemPostProcessor(PostProcessor):
+    """
+    Runs after each item has been downloaded, converted and moved,
+    so it can be tagged while the rest of the playlist downloads.
+    """
+    def __init__(
+            self,
+            callback:typing.Callable[[dict[str,typing.Any]],None]
+        ) -> None:
+        """
+        Runs after each item has been downloaded, converted and moved.
+
+        :param callback:
+        Called with the metadata of each finished item.
+        """
+        super().__init__()
+        self.callback = callback
+
+    def run(
+            self,
+            information:dict[str,typing.Any]
+        ) -> tuple[list[str],dict[str,typing.Any]]:
+        """
+        Pass the finished item to the callback.
+
+        :returns files_to_delete, information:
+        No files to delete and the unchanged metadata.
+        """
+        self.callback(information)
+        return [], information
@@ -1,12 +1,20 @@
 import os
+import shlex
+import shutil
 import hashlib
 import typing
+import tempfile
+import threading
 import subprocess
-import cv2
-import numpy as np
 import configure
+import lazy
+import cache
 from handler import BaseHandler, DEBUG, INFO, WARNING, ERROR  #pylint: disable=W0611
 
+# imported on first use, they are slow to load
+cv2 = lazy.LazyModule("cv2")
+np = lazy.LazyModule("numpy")
+
 PICK_SINGLE_AUTO = 0
 PICK_SINGLE_MANUAL = 1
 
@@ -14,12 +22,185 @@ PICK_GROUP_EACH = 0
 PICK_GROUP_MOST_COMMON = 1
 PICK_GROUP_MANUAL = 2
 
+# the upscaler builds for linux have no file extension
+EXE_SUFFIX = ".exe" if os.name == "nt" else ""
+
+# default AI upscalers, name and program inside the AI directory
+AI_PROGRAMS = [
+    [ "RealSR", "realsr-ncnn-vulkan" ],
+    [ "Waifu2x", "waifu2x-ncnn-vulkan" ],
+    [ "SRMD", "srmd-ncnn-vulkan" ],
+]
+
+HASH_DIFFERENCE = 0
+HASH_AVERAGE = 1
+HASH_PERCEPTUAL = 2
+
+# values of cv2.INTER_LINEAR, cv2.INTER_AREA and cv2.INTER_LANCZOS4,
+# written out so cv2 is not loaded to build the default configuration
 SCALE_TYPES = [
-    [ cv2.INTER_LINEAR,   "Fastest" ], #pylint:disable=E1101
-    [ cv2.INTER_AREA,     "Balanced" ], #pylint:disable=E1101
-    [ cv2.INTER_LANCZOS4, "Best Quality" ], #pylint:disable=E1101
+    [ 1, "Fastest" ],
+    [ 3, "Balanced" ],
+    [ 4, "Best Quality" ],
 ]
 
+def hash_images(
+        images:list["np.ndarray|None"],
+        method:int=HASH_DIFFERENCE,
+        hash_size:int=8
+    ) -> list[str]:
+    """
+    Compute the similarity hashes of several images at once.
+    The images are reduced to small grayscale thumbnails which are
+    compared and packed into bits as one stacked array.
+
+    :param images:
+    Decoded BGR images, `None` for images that failed to open.
+
+    :param method:
+    `HASH_DIFFERENCE`, `HASH_AVERAGE` or `HASH_PERCEPTUAL`
+
+    :param hash_size:
+    The hashes will be `hash_size**2` bits long.
+
+    :returns hashes:
+    Hash strings in the same order as the images,
+    `"00...00"` for images that failed to open.
+    """
+    thumbnails = [reduce_image(image, method, hash_size) for image in images]
+    return hash_thumbnails(thumbnails, method, hash_size)
+
+def reduce_image(
+        image:"np.ndarray|None",
+        method:int=HASH_DIFFERENCE,
+        hash_size:int=8
+    ) -> "np.ndarray|None":
+    """
+    Reduce an image to the grayscale thumbnail compared by a hash,
+    so the full image does not need to be kept for hashing.
+
+    :param image:
+    Decoded BGR image or `None`.
+
+    :param method:
+    `HASH_DIFFERENCE`, `HASH_AVERAGE` or `HASH_PERCEPTUAL`
+
+    :param hash_size:
+    The hash will be `hash_size**2` bits long.
+
+    :returns thumbnail:
+    Grayscale thumbnail or `None` if there is no image.
+    """
+    if image is None:
+        return None
+
+    # difference hash compares neighbours, so needs an extra column
+    # perceptual hash keeps the low frequencies of a larger thumbnail
+    if method == HASH_DIFFERENCE:
+        size = (hash_size + 1, hash_size)
+    elif method == HASH_PERCEPTUAL:
+        size = (hash_size * 4, hash_size * 4)
+    else:
+        size = (hash_size, hash_size)
+
+    grayscale = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) #pylint:disable=E1101
+    return cv2.resize(grayscale, size) #pylint:disable=E1101
+
+def hash_thumbnails(
+        thumbnails:list["np.ndarray|None"],
+        method:int=HASH_DIFFERENCE,
+        hash_size:int=8
+    ) -> list[str]:
+    """
+    Compute the similarity hashes of thumbnails from `reduce_image`
+    as one stacked array.
+
+    :param thumbnails:
+    Grayscale thumbnails, `None` for images that failed to open.
+
+    :param method:
+    `HASH_DIFFERENCE`, `HASH_AVERAGE` or `HASH_PERCEPTUAL`
+
+    :param hash_size:
+    The hashes will be `hash_size**2` bits long.
+
+    :returns hashes:
+    Hash strings in the same order as the thumbnails,
+    `"00...00"` for images that failed to open.
+    """
+    hashes = ["0" * (hash_size * hash_size // 4)] * len(thumbnails)
+    valid = [i for i, thumb in enumerate(thumbnails) if thumb is not None]
+    if len(valid) == 0:
+        return hashes
+
+    stacked = np.stack([thumbnails[i] for i in valid]).astype(np.float32)
+
+    if method == HASH_DIFFERENCE:
+        # modified dhash function from this blog post:
+        # https://pyimagesearch.com/2017/11/27/image-hashing-opencv-python/
+        bits = stacked[:, :, 1:] > stacked[:, :, :-1]
+    elif method == HASH_PERCEPTUAL:
+        dct = _dct_matrix(stacked.shape[1])
+        freq = dct @ stacked @ dct.T
+        low = freq[:, :hash_size, :hash_size].reshape(len(valid), -1)
+        # the first term is the average brightness, leave it out
+        median = np.median(low[:, 1:], axis=1, keepdims=True)
+        bits = low > median
+    else:
+        bits = stacked > stacked.mean(axis=(1, 2), keepdims=True)
+
+    packed = np.packbits(bits.reshape(len(valid), -1), axis=1)
+    for i, row in zip(valid, packed):
+        hashes[i] = row.tobytes().hex()
+    return hashes
+
+def _dct_matrix(size:int) -> "np.ndarray":
+    """
+    Build the orthonormal DCT-II matrix,
+    `m @ x @ m.T` is the 2D DCT of a square array `x`.
+
+    :param size:
+    Width of the square arrays.
+
+    :returns matrix:
+    `size` by `size` array.
+    """
+    k = np.arange(size).reshape(-1, 1)
+    n = np.arange(size).reshape(1, -1)
+    matrix = np.sqrt(2 / size) * np.cos(np.pi * (2 * n + 1) * k / (2 * size))
+    matrix[0] /= np.sqrt(2)
+    return matrix.astype(np.float32)
+
+# cover format: (file extension, opencv quality flag, mime type),
+# the flags are cv2.IMWRITE_JPEG_QUALITY and cv2.IMWRITE_WEBP_QUALITY
+ENCODERS = {
+    "png":  (".png",  None, "image/png"),
+    "jpeg": (".jpg",  1,    "image/jpeg"),
+    "webp": (".webp", 64,   "image/webp"),
+}
+
+# lowest quality tried when fitting a cover into the byte budget
+MIN_QUALITY = 10
+
+def upscale_steps(size:int, target:int) -> int:
+    """
+    Count the 4x upscaling steps needed to reach the target size.
+
+    :param size:
+    Current side length, `0` if unknown.
+
+    :param target:
+    Side length to reach.
+
+    :returns steps:
+    Number of steps, `0` if the size is unknown or already large enough.
+    """
+    steps = 0
+    while 0 < size < target:
+        size *= 4
+        steps += 1
+    return steps
+
 class ImageConfig(configure.Config):
     """
     Configuration data structure for the image modifier.
@@ -29,11 +210,11 @@ class ImageConfig(configure.Config):
         Import configuration from the config json file if it exists,
         otherwise create one.
         """
-        self._configdir = "config\\image.json"
+        self._configdir = os.path.join("config", "image.json")
         super().__init__()
 
+        # probed when the models are first listed
         self.valid_ai_models = []
-        self._check_valid_models()
 
     def _check_valid_models(self) -> None:
         """Check if the AI model executables exist."""
@@ -53,9 +234,9 @@ class ImageConfig(configure.Config):
         if not os.path.exists(target_path):
             return False
 
-        # must have valid file extension
+        # must have valid file extension, linux builds have none
         ext = os.path.splitext(target)[1].lower()
-        if ext not in [".exe"]:
+        if ext not in [".exe", ""]:
             return False
 
         # it is not invalid, so it must be valid
@@ -70,21 +251,23 @@ class ImageConfig(configure.Config):
         """Get available interpolation methods."""
         return [name for _, name in self.config["interpolation"]]
 
+    def get_mime(self) -> str:
+        """Get the mime type of the encoded covers."""
+        cover_format = self.config["cover_format"]
+        return ENCODERS.get(cover_format, ENCODERS["png"])[2]
+
     def default(self) -> None:
         """Load the default configuration."""
-        ais = [{
-            "name":    "RealSR",
-            "target":  "{root}\\realsr-ncnn-vulkan\\realsr-ncnn-vulkan.exe",
-            "options": "-m \"{root}\\realsr-ncnn-vulkan\\models-DF2K\" -i \"{input}\" -o \"{output}\" -s {scale}"
-        },{
-            "name":    "Waifu2x",
-            "target":  "{root}\\waifu2x-ncnn-vulkan\\waifu2x-ncnn-vulkan.exe",
-            "options": "-m \"{root}\\waifu2x-ncnn-vulkan\\models-DF2K\" -i \"{input}\" -o \"{output}\" -s {scale}"
-        },{
-            "name":    "SRMD",
-            "target":  "{root}\\srmd-ncnn-vulkan\\srmd-ncnn-vulkan.exe",
-            "options": "-m \"{root}\\srmd-ncnn-vulkan\\models-DF2K\" -i \"{input}\" -o \"{output}\" -s {scale}"
-        }]
+        ais = []
+        for name, program in AI_PROGRAMS:
+            folder = os.path.join("{root}", program)
+            models = os.path.join(folder, "models-DF2K")
+            ais.append({
+                "name":    name,
+                "target":  os.path.join(folder, program + EXE_SUFFIX),
+                "options": f"-m \"{models}\" "
+                    + "-i \"{input}\" -o \"{output}\" -s {scale}"
+            })
 
         self.config = {
             "add_image_single":       PICK_SINGLE_AUTO,
@@ -93,7 +276,15 @@ class ImageConfig(configure.Config):
             "interpolation":          SCALE_TYPES,
             "interpolate_method":     2,
             "ai_method":              0,
+            "hash_method":            HASH_DIFFERENCE,
+            "hash_distance_threshold": 4,
             "ai_directory":           "ai",
+            "ai_batch":               True,
+            "cover_format":           "jpeg",
+            "cover_quality":          90,
+            "cover_max_bytes":        0,
+            "cache_directory":        "cache",
+            "cache_size_limit":       256,
             "ai_commands":            ais
         }
 
@@ -104,48 +295,82 @@ class ImageFormatHandler(BaseHandler):
     """
     def __init__(self) -> None:
         super().__init__(ImageConfig(), ImageFormatter)
+        self.cache = cache.CoverCache(self.config)
+        # encoded covers, kept in memory until they are attached
+        self.images:dict[str,bytes] = {}
         self.hash_frequency:dict[str,dict[str,typing.Any]] = {}
+        # shared with the other items of a playlist tagged one at a time
+        self.clusters:CoverClusters|None = None
         self.config:ImageConfig
         self.formatters:list[ImageFormatter]
 
+    def set_clusters(self, clusters:"CoverClusters|None") -> None:
+        """
+        Share the covers with other handlers of the same playlist.
+
+        :param clusters:
+        Covers of the items processed before, `None` to process
+        the items on their own.
+        """
+        self.clusters = clusters
+
     def post_process(self) -> None:
         """Run the formatting on the images."""
-        self.hash_frequency = {}
-        seen_hash_crypt = set()
-        seen_hash_diff = set()
-        seen_hash_lookup = {}
+        if self.clusters is None:
+            self.hash_frequency = {}
+            self.images = {}
+            self._post_process(HashIndex())
+            return
 
+        # items of a playlist take turns, so each can reuse
+        # the covers of the items before it
+        with self.clusters.lock:
+            self.hash_frequency = self.clusters.hash_frequency
+            if self.cache.enabled():
+                # covers of earlier items are read back from the cache
+                self.images = {}
+            else:
+                self.images = self.clusters.images
+            self._post_process(self.clusters.index)
+
+            # only the covers are kept for the next items
+            for stats in self.hash_frequency.values():
+                stats["members"] = []
+
+    def _post_process(self, index:"HashIndex") -> None:
+        """
+        Cluster the images and process one of each cluster.
+
+        :param index:
+        Hashes of the clusters found so far.
+        """
         self.log("[image] Processing images", INFO)
         self.log("[image] Computing similarity hashes", INFO)
-        for inst in self.formatters:
-            # open the image
-            inst.open_image()
-
-            # check for image similarity
-            hash_crypt = inst.hash_cryptographic()
-            if hash_crypt in seen_hash_crypt:
-                # identical image found, do not recompute
-                hash_diff = seen_hash_lookup[hash_crypt]
-                inst.set_hash_difference(hash_diff)
-            else:
-                # the image is not identical, but it may look similar
-                hash_diff = inst.hash_difference()
+        self.hash_all()
 
-                # add this hash to the lookup
-                seen_hash_crypt.add(hash_crypt)
-                seen_hash_diff.add(hash_diff)
-                seen_hash_lookup[hash_crypt] = hash_diff
+        # covers within the distance threshold share one cluster,
+        # keyed by the hash of the first cover seen
+        threshold = self.config.get_value("hash_distance_threshold")
+        for inst in self.formatters:
+            hash_diff = inst.get_hash_difference()
+            cluster = index.find(hash_diff, threshold)
 
-            if hash_diff in self.hash_frequency:
+            if cluster is not None:
                 # similar already computed, pick from the LUT
-                self.hash_frequency[hash_diff]["frequency"] += 1
+                self.hash_frequency[cluster]["frequency"] += 1
+                self.hash_frequency[cluster]["members"].append(inst)
             else:
                 # image is visually distinct and needs to be processed
+                index.add(hash_diff)
                 stats = {}
                 stats["frequency"] = 1
-                out_path = f"{inst.get_image_root()}\\{hash_diff}.png"
+                out_path = os.path.join(
+                    inst.get_image_root(),
+                    f"{hash_diff}.png"
+                )
                 stats["output"] = out_path
                 stats["processed"] = False
+                stats["members"] = [inst]
                 self.hash_frequency[hash_diff] = stats
 
         first_hash_item = list(self.hash_frequency.values())[0]
@@ -159,6 +384,8 @@ class ImageFormatHandler(BaseHandler):
             )
             self.formatters[0].set_image_output(first_hash_item["output"])
             self.formatters[0].process_image()
+            first_hash_item["processed"] = True
+            first_hash_item["cache_key"] = self.formatters[0].get_cache_key()
         else:
             # item is a group
             add_group = self.config.get_value("add_image_group")
@@ -170,47 +397,372 @@ class ImageFormatHandler(BaseHandler):
 
         self.log("[image] Finished processing images")
 
-    def get_images(self) -> list[str]:
-        """Get the directories of the images."""
-        _image_paths = []
+    def hash_all(self) -> None:
+        """
+        Compute the similarity hashes of all the images.
+        Identical files are decoded once, and each image is only kept
+        as a small thumbnail until the hashes are computed in one batch.
+        """
+        method = self.config.get_value("hash_method")
+        groups:dict[str,list[ImageFormatter]] = {}
+        thumbnails = []
         for inst in self.formatters:
-            _image_paths.append(inst.get_image_output())
-        return _image_paths
+            hash_crypt = inst.hash_cryptographic()
+            if hash_crypt in groups:
+                # identical image found, do not decode again
+                inst.set_shape(groups[hash_crypt][0].get_shape())
+            else:
+                groups[hash_crypt] = []
+                inst.open_image()
+                thumbnails.append(reduce_image(inst.image, method))
+                inst.release()
+            groups[hash_crypt].append(inst)
+
+        hashes = hash_thumbnails(thumbnails, method)
+        for group, _hash in zip(groups.values(), hashes):
+            for inst in group:
+                inst.set_hash_difference(_hash)
+
+    def release(self) -> None:
+        """Free the decoded images of all the formatters."""
+        for inst in self.formatters:
+            inst.release()
+
+    def get_images(self) -> list[bytes|None]:
+        """
+        Get the encoded images, formatters sharing a cover
+        share the same bytes object.
+
+        :returns images:
+        Encoded image per formatter or `None` if it failed.
+        """
+        _images = []
+        for inst in self.formatters:
+            _images.append(self.images.get(inst.get_image_output()))
+        return _images
+
+    def get_mime(self) -> str:
+        """Get the mime type of the encoded images."""
+        return self.config.get_mime()
+
+    def set_image_data(self, output:str, data:bytes) -> None:
+        """
+        Store an encoded image for the formatters using an output.
+
+        :param output:
+        Output image path used as the key.
+
+        :param data:
+        Encoded image.
+        """
+        self.images[output] = data
 
     def process_each_unique(self) -> None:
         """Process each unique image and attach it."""
-        for i, inst in enumerate(self.formatters):
-            self.log(
-                f"[image] Processing image {i} of {len(self.formatters)}",
-                INFO
-            )
-            hash_diff = inst.get_hash_difference()
-            if self.hash_frequency[hash_diff]["processed"] is False:
-                # need to process this new image
-                inst.process_image()
-                self.hash_frequency[hash_diff]["processed"] = True
+        # clusters of earlier items of the playlist have no members
+        clusters = [
+            stats for stats in self.hash_frequency.values()
+            if len(stats["members"]) > 0
+        ]
+        for stats in clusters:
+            for inst in stats["members"]:
+                inst.set_image_output(stats["output"])
+
+        self.log(
+            f"[image] Processing {len(clusters)} unique images",
+            INFO
+        )
+        self.process_clusters(clusters)
 
     def process_most_common(self) -> None:
         """Process only the most common image and attach it."""
         # find the most common image
-        most_common = ""
+        most_common = None
         most_common_freq = 0
         for _hash_freq in self.hash_frequency.values():
             freq = _hash_freq["frequency"]
             if freq > most_common_freq:
                 most_common_freq = freq
-                most_common = _hash_freq["output"]
+                most_common = _hash_freq
 
         # set the output path
         for inst in self.formatters:
-            inst.set_image_output(most_common)
+            inst.set_image_output(most_common["output"])
 
         self.log(
             "[image] Processing image 1 of 1",
             INFO
         )
 
-        self.formatters[0].process_image()
+        self.process_clusters([most_common])
+
+    def process_clusters(self, clusters:list[dict[str,typing.Any]]) -> None:
+        """
+        Process one cover of each cluster of similar covers.
+        Covers needing AI upscaling are upscaled together
+        when batching is enabled.
+
+        :param clusters:
+        Clusters from `hash_frequency`.
+        """
+        pending:list[ImageFormatter] = []
+        for stats in clusters:
+            if stats["processed"] is True:
+                if self.fetch_processed(stats):
+                    continue
+                if len(stats["members"]) == 0:
+                    # only earlier items had this cover
+                    self.log("[image] Cover no longer cached", WARNING)
+                    continue
+                self.log("[image] Cover no longer cached, processing again")
+            stats["processed"] = True
+
+            # the largest copy gives the best result
+            largest = max(stats["members"], key=lambda inst: inst.get_area())
+            stats["cache_key"] = largest.get_cache_key()
+            if largest.fetch_cached():
+                continue
+            if largest.prepare_image():
+                pending.append(largest)
+
+        if len(pending) > 1 \
+            and self.config.get_value("ai_method") != 0 \
+            and self.config.get_value("ai_batch"):
+            self.upscale_batch(pending)
+        else:
+            for inst in pending:
+                inst.upscale_image()
+
+        for inst in pending:
+            inst.finish_image()
+
+    def fetch_processed(self, stats:dict[str,typing.Any]) -> bool:
+        """
+        Get the cover of a cluster processed for an earlier item.
+
+        :param stats:
+        Cluster from `hash_frequency`.
+
+        :returns found:
+        `True` if the cover is in memory or was read from the cache.
+        """
+        if stats["output"] in self.images:
+            return True
+
+        data = self.cache.get(stats["cache_key"])
+        if data is None:
+            return False
+        self.set_image_data(stats["output"], data)
+        return True
+
+    def upscale_batch(self, formatters:list["ImageFormatter"]) -> None:
+        """
+        Upscale several images with one run of the upscaler per 4x step,
+        so the model is loaded once rather than once per image.
+        Images the batch fails on are upscaled one at a time.
+
+        :param formatters:
+        Formatters with cropped images.
+        """
+        target = self.config.get_value("image_size_target")
+        pending = [inst for inst in formatters if inst.get_size() < target]
+        if len(pending) == 0:
+            self.log("[image] Sizes are not smaller than target, skipping", INFO)
+            return
+
+        # the upscaler may not enlarge an image as expected,
+        # so stop after as many steps as the smallest image needs
+        steps = max(upscale_steps(inst.get_size(), target) for inst in pending)
+
+        root = pending[0].get_image_root()
+        dir_to_ai = tempfile.mkdtemp(dir=root)
+        dir_from_ai = tempfile.mkdtemp(dir=root)
+
+        try:
+            for _ in range(steps):
+                if len(pending) == 0:
+                    break
+                self.log(
+                    f"[image] Upscaling {len(pending)} images together",
+                    INFO
+                )
+                sizes = [inst.get_size() for inst in pending]
+                for i, inst in enumerate(pending):
+                    inst.export(os.path.join(dir_to_ai, f"{i}.png"))
+
+                failed = []
+                if self.run_upscaler(dir_to_ai, dir_from_ai):
+                    for i, inst in enumerate(pending):
+                        path = os.path.join(dir_from_ai, f"{i}.png")
+                        if not inst.open_image(path, True):
+                            failed.append(inst)
+                else:
+                    failed = pending
+
+                for directory in [dir_to_ai, dir_from_ai]:
+                    for file in os.listdir(directory):
+                        os.remove(os.path.join(directory, file))
+
+                # fall back to one at a time
+                for inst in failed:
+                    inst.upscale_image()
+
+                grown = []
+                for inst, size in zip(pending, sizes):
+                    if inst in failed:
+                        continue
+                    if inst.get_size() <= size:
+                        self.log(
+                            f"[image] Upscaler did not enlarge "
+                            f"{inst.get_image_input()}, stopping",
+                            WARNING
+                        )
+                        continue
+                    grown.append(inst)
+
+                pending = [
+                    inst for inst in grown if inst.get_size() < target
+                ]
+
+            if len(pending) > 0:
+                self.log(
+                    f"[image] {len(pending)} images are still smaller "
+                    f"than target after {steps} steps",
+                    WARNING
+                )
+        finally:
+            shutil.rmtree(dir_to_ai, ignore_errors=True)
+            shutil.rmtree(dir_from_ai, ignore_errors=True)
+
+    def run_upscaler(self, input_path:str, output_path:str) -> bool:
+        """
+        Run the selected AI upscaler once at 4x.
+
+        :param input_path:
+        Image file, or directory of images, to upscale.
+
+        :param output_path:
+        Image file, or directory, to write to.
+
+        :returns success:
+        `True` if the upscaler finished without errors.
+        """
+        model_index = self.config.get_value("ai_method") - 1
+
+        # build the command to run the upscaler
+        params = {
+            "root": self.config.get_value("ai_directory"),
+            "input": input_path,
+            "output": output_path,
+            "scale": 4
+        }
+        parts = self.config.get_value("ai_commands")[model_index]
+        # split before filling in, so paths with spaces stay whole
+        command = [parts["target"].format(**params)] + [
+            option.format(**params) for option in shlex.split(parts["options"])
+        ]
+
+        self.log(
+            f"[debug] Subprocess: {shlex.join(command)}",
+            DEBUG
+        )
+
+        # upscale image using selected engine
+        try:
+            subprocess.run(
+                command,
+                check=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT
+            )
+        except (subprocess.CalledProcessError, OSError) as e:
+            self.log(f"[image] Upscaler failed: {e}", WARNING)
+            return False
+        return True
+
+class CoverClusters:
+    """
+    Clusters of similar covers, shared by the handlers of the items
+    of a playlist that are tagged as soon as they download,
+    so a cover is only processed for the first item.
+    Later items read the cover back from the cover cache, the encoded
+    images are only kept here when the cache is disabled.
+    """
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.index = HashIndex()
+        self.hash_frequency:dict[str,dict[str,typing.Any]] = {}
+        self.images:dict[str,bytes] = {}
+
+class HashIndex:
+    """
+    BK-tree of similarity hashes.
+    Finds hashes within a Hamming distance of a query
+    without comparing it against every hash in the tree.
+    """
+    def __init__(self) -> None:
+        # each node is (hash, {distance: child node})
+        self.root:tuple[int,dict]|None = None
+        self.hexes:dict[int,str] = {}
+
+    def add(self, _hex:str) -> None:
+        """
+        Add a hash to the index.
+
+        :param _hex:
+        Hash string.
+        """
+        value = int(_hex, 16)
+        self.hexes[value] = _hex
+        if self.root is None:
+            self.root = (value, {})
+            return
+
+        node = self.root
+        while True:
+            distance = (node[0] ^ value).bit_count()
+            if distance == 0:
+                return
+            if distance not in node[1]:
+                node[1][distance] = (value, {})
+                return
+            node = node[1][distance]
+
+    def find(self, _hex:str, threshold:int) -> str|None:
+        """
+        Find the closest hash within a distance.
+
+        :param _hex:
+        Hash string to look up.
+
+        :param threshold:
+        Maximum number of differing bits.
+
+        :returns closest:
+        Closest hash string or `None` if none are close enough.
+        """
+        if self.root is None:
+            return None
+
+        value = int(_hex, 16)
+        best = None
+        best_distance = threshold + 1
+        nodes = [self.root]
+        while len(nodes) > 0:
+            node = nodes.pop()
+            distance = (node[0] ^ value).bit_count()
+            if distance < best_distance:
+                best = node[0]
+                best_distance = distance
+
+            # triangle inequality, other branches cannot be close enough
+            for child_distance, child in node[1].items():
+                if abs(child_distance - distance) <= threshold:
+                    nodes.append(child)
+
+        if best is None:
+            return None
+        return self.hexes[best]
 
 class ImageFormatter:
     """
@@ -233,6 +785,7 @@ class ImageFormatter:
         self.image_input_path = self.meta["thumbnails"][-1]["filepath"]
         self.image_output_path = self.image_input_path
         self.image = None
+        self.shape = (0, 0)
 
         # initialise empty hashes
         self.hash_crypt = "0" * 64
@@ -257,6 +810,39 @@ class ImageFormatter:
         root = self.meta["requested_downloads"][0]["__finaldir"]
         return root
 
+    def get_size(self) -> int:
+        """
+        Get the length of the shortest side of the opened image.
+
+        :returns size:
+        Side length or `0` if the image is not open.
+        """
+        if self.image is None:
+            return 0
+        return min(self.image.shape[0:2])
+
+    def get_area(self) -> int:
+        """
+        Get the number of pixels in the image,
+        known once it has been opened, even if it was released.
+
+        :returns area:
+        Pixel count or `0` if the image has not opened.
+        """
+        return self.shape[0] * self.shape[1]
+
+    def get_shape(self) -> tuple[int,int]:
+        """Get the height and width of the image."""
+        return self.shape
+
+    def set_shape(self, shape:tuple[int,int]) -> None:
+        """Set the height and width of the image."""
+        self.shape = shape
+
+    def release(self) -> None:
+        """Free the decoded image, it is opened again when needed."""
+        self.image = None
+
     def set_image_output(self, image_path:str) -> None:
         """
         Set the output path of the image.
@@ -268,7 +854,8 @@ class ImageFormatter:
 
     def get_image_output(self) -> str:
         """
-        Get the output path of the image.
+        Get the output path of the image,
+        formatters sharing a cover share the output path.
 
         :returns image_path:
         Output image path.
@@ -301,42 +888,31 @@ class ImageFormatter:
 
     def hash_difference(self, hash_size:int=8) -> str:
         """
-        Compute the difference hash of the image file.
+        Compute the similarity hash of the image file.
         It is much slower than a cryptographic hash.
+        Use :func:`hash_images` to hash many images at once.
 
         :param hash_size:
-        The hash will be `2**hash_size` bits long.
+        The hash will be `hash_size**2` bits long.
 
         :returns _hex:
         Hash string or `"00...00"` on failure.
         """
-        # modified dhash function from this blog post:
-        # https://pyimagesearch.com/2017/11/27/image-hashing-opencv-python/
-
-        if self.image is None:
-            # the image did not open successfully
-            return "0" * (hash_size * 2)
-
-        # compute the difference image
-        grayscale = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY) #pylint:disable=E1101
-        resized = cv2.resize(grayscale, (hash_size + 1, hash_size)) #pylint:disable=E1101
-        diff = resized[:, 1:] > resized[:, :-1]
-
-        # convert the difference image to a hash
-        _hash = sum(2 ** i for (i, v) in enumerate(diff.flatten()) if v)
-
-        # return as hex string
-        _hex = f"{_hash:0{hash_size*2}x}"
+        _hex = hash_images(
+            [self.image],
+            self.config.get_value("hash_method"),
+            hash_size
+        )[0]
         self.set_hash_difference(_hex)
         return _hex
 
     def set_hash_cryptographic(self, _hash:str) -> None:
         """Set the sha256 hash."""
-        self.hash_diff = _hash
+        self.hash_crypt = _hash
 
     def get_hash_cryptographic(self) -> str:
         """Get the computed sha256 hash."""
-        return self.hash_diff
+        return self.hash_crypt
 
     def set_hash_difference(self, _hash:str) -> None:
         """Set the hash difference."""
@@ -348,18 +924,89 @@ class ImageFormatter:
 
     def process_image(self):
         """Transform the image into the desired format."""
-        # image needs to be square
-        self.crop_image()
+        if self.fetch_cached():
+            return
+
+        if not self.prepare_image():
+            return
 
         # check if ai upscaling is enabled
         if self.config.get_value("ai_method") != 0:
             self.upscale_image()
 
+        self.finish_image()
+
+    def fetch_cached(self) -> bool:
+        """
+        Reuse the result of an earlier run if possible.
+
+        :returns cached:
+        `True` if the output was taken from the cache.
+        """
+        data = self.handler.cache.get(self.get_cache_key())
+        if data is None:
+            return False
+
+        self.handler.log("[image] Using cached cover", INFO)
+        self.handler.set_image_data(self.get_image_output(), data)
+        return True
+
+    def prepare_image(self) -> bool:
+        """
+        Prepare the image for upscaling.
+
+        :returns success:
+        `False` if the image could not be opened.
+        """
+        # the image is released after hashing
+        if not self.open_image():
+            self.handler.log(
+                f"[image] Failed to open {self.get_image_input()}",
+                WARNING
+            )
+            return False
+
+        # image needs to be square
+        self.crop_image()
+        return True
+
+    def finish_image(self) -> None:
+        """Resize the upscaled image, encode and cache it."""
         # do not resize the image if scaling is disabled
         if self.config.get_value("interpolate_method") != 0:
             self.resize_image()
 
-        self.export()
+        # the image stays in memory, only the upscaler needs files
+        data = self.encode()
+        if data is None:
+            return
+
+        self.handler.set_image_data(self.get_image_output(), data)
+        self.handler.cache.put(self.get_cache_key(), data)
+        self.release()
+
+    def get_cache_key(self) -> str:
+        """
+        Get the cover cache key of this image,
+        built from the input file and the processing parameters.
+
+        :returns key:
+        Hash string.
+        """
+        ai_method = self.config.get_value("ai_method")
+        ai_name = "None"
+        if ai_method != 0:
+            ai_name = self.config.get_value("ai_commands")[ai_method - 1]["name"]
+
+        return cache.CoverCache.get_key(
+            self.get_hash_cryptographic(),
+            self.config.get_value("image_size_target"),
+            ai_name,
+            self.config.get_value("interpolate_method"),
+            self.config.get_value("cover_format"),
+            self.config.get_value("cover_quality"),
+            self.config.get_value("cover_max_bytes")
+        )
 
     def open_image(self, path:str=None, reload:bool=False) -> bool:
         """
@@ -380,14 +1027,16 @@ class ImageFormatter:
 
         # open the image if not already or forced to
         if reload or self.image is None:
-            self.image = cv2.imread(path) #pylint:disable=E1101
+            image = cv2.imread(path) #pylint:disable=E1101
 
-        # image opened without errors
-        if self.image is not None:
-            return True
+            # failed to open image, keep what was already open
+            if image is None:
+                return False
+            self.image = image
+            self.shape = image.shape[0:2]
 
-        # failed to open image
-        return False
+        # image opened without errors
+        return self.image is not None
 
     def crop_image(self) -> None:
         """Crop the image square."""
@@ -404,77 +1053,68 @@ class ImageFormatter:
     def upscale_image(self) -> None:
         """Upscale the input image."""
         # check if ai upscaling is disabled
-        model_index = self.config.get_value("ai_method")
-        if model_index == 0:
+        if self.config.get_value("ai_method") == 0:
             return
-        model_index -= 1
 
-        size = min(self.image.shape[0:2])
+        size = self.get_size()
         target = self.config.get_value("image_size_target")
+        steps = upscale_steps(size, target)
 
         scaled = False
         retries = 3
-        dir_to_ai = f"{self.get_image_root()}\\temp.png"
-        dir_from_ai = f"{self.get_image_root()}\\temp_out.png"
+        # temporary files are named after the input so that several
+        # items can be upscaled at the same time
+        stem = os.path.splitext(self.get_image_input())[0]
+        dir_to_ai = f"{stem}-temp.png"
+        dir_from_ai = f"{stem}-temp_out.png"
 
-        if target > size:
+        if steps > 0:
             self.export(dir_from_ai)
 
         # upscale the image in 4x chunks
-        while target > size:
-            scaled = True
+        while steps > 0:
             self.handler.log(
                 f"[image] Upscaling from {size}x{size} to {size*4}x{size*4}",
                 INFO
             )
 
-            # create input file for ai upscaler
-            if os.path.exists(dir_to_ai):
-                os.remove(dir_to_ai)
-            os.rename(dir_from_ai, dir_to_ai)
-
-            # build the command to run the upscaler
-            params = {
-                "root": self.config.get_value("ai_directory"),
-                "input": dir_to_ai,
-                "output": dir_from_ai,
-                "scale": 4
-            }
-            parts = self.config.get_value("ai_commands")[model_index]
-            command = parts["target"].format(**params) \
-                + " " \
-                + parts["options"].format(**params)
+            # the output of the last step is the input of the next
+            if os.path.exists(dir_from_ai):
+                if os.path.exists(dir_to_ai):
+                    os.remove(dir_to_ai)
+                os.rename(dir_from_ai, dir_to_ai)
 
-            self.handler.log(
-                f"[debug] Subprocess: {command}",
-                DEBUG
-            )
-
-            # upscale image using selected engine
-            result = subprocess.run(
-                command,
-                check=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT
-            )
-            size *= 4
+            if self.handler.run_upscaler(dir_to_ai, dir_from_ai):
+                scaled = True
+                size *= 4
+                steps -= 1
+                continue
 
             # break if too many errors
-            if result.returncode != 0:
-                retries -= 1
-                if retries < 0:
-                    self.handler.log(
-                        "[image] Failed to upscale image",
-                        ERROR
-                    )
-                    break
+            retries -= 1
+            if retries < 0:
                 self.handler.log(
-                    f"[image] Error upscaling image, {retries} retry(s) left",
-                    WARNING
+                    "[image] Failed to upscale image",
+                    ERROR
                 )
+                break
+            self.handler.log(
+                f"[image] Error upscaling image, {retries} retry(s) left",
+                WARNING
+            )
 
         if scaled is True:
-            self.open_image(dir_from_ai, True)
+            original = self.get_size()
+            if os.path.exists(dir_from_ai):
+                self.open_image(dir_from_ai, True)
+            else:
+                self.open_image(dir_to_ai, True)
+            if self.get_size() <= original:
+                self.handler.log(
+                    "[image] Upscaler did not enlarge "
+                    f"{self.get_image_input()}",
+                    WARNING
+                )
         else:
             self.handler.log(
                 "[image] Size is not smaller than target, skipping",
@@ -492,8 +1132,70 @@ class ImageFormatter:
         self.image = cv2.resize( #pylint:disable=E1101
             self.image,
             dsize=(_target, _target),
-            interpolation=SCALE_TYPES[self.config.get_value("interpolation_method") - 1][0]
+            interpolation=SCALE_TYPES[self.config.get_value("interpolate_method") - 1][0]
+        )
+
+    def encode(self) -> bytes|None:
+        """
+        Encode the image in memory with the configured format.
+        If a byte budget is set, the highest quality that fits is used.
+
+        :returns data:
+        Encoded image or `None` on failure.
+        """
+        cover_format = self.config.get_value("cover_format")
+        quality = int(self.config.get_value("cover_quality"))
+        max_bytes = int(self.config.get_value("cover_max_bytes"))
+        ext, flag, _ = ENCODERS.get(cover_format, ENCODERS["png"])
+
+        def _encode(_quality:int) -> bytes|None:
+            params = [] if flag is None else [flag, _quality]
+            ret, buffer = cv2.imencode(ext, self.image, params) #pylint:disable=E1101
+            if ret is False:
+                return None
+            return buffer.tobytes()
+
+        data = _encode(quality)
+        if data is None:
+            self.handler.log("[export] Failed to encode image", ERROR)
+            return None
+
+        if max_bytes <= 0 or len(data) <= max_bytes:
+            return data
+
+        if flag is None:
+            # lossless, there is no quality to lower
+            self.handler.log(
+                f"[export] {cover_format} cover does not fit in "
+                f"{max_bytes} bytes, use jpeg or webp to limit its size",
+                WARNING
+            )
+            return data
+
+        # search for the highest quality within the budget
+        best = None
+        low, high = MIN_QUALITY, quality - 1
+        while low <= high:
+            mid = (low + high) // 2
+            attempt = _encode(mid)
+            if attempt is not None and len(attempt) <= max_bytes:
+                best = attempt
+                low = mid + 1
+            else:
+                high = mid - 1
+
+        if best is None:
+            self.handler.log(
+                f"[export] Cover does not fit in {max_bytes} bytes",
+                WARNING
+            )
+            best = _encode(MIN_QUALITY)
+
+        self.handler.log(
+            f"[export] Encoded cover in {len(best)} bytes",
+            DEBUG
         )
+        return best
 
     def export(self, directory:str=None) -> None:
         """Save the image."""
@@ -0,0 +1,288 @@
+import os
+import json
+import time
+import typing
+import sqlite3
+import threading
+
+# states of an item, each one implies the ones before it
+ITEM_QUEUED = 0
+ITEM_DOWNLOADED = 1
+ITEM_COVER = 2
+ITEM_TAGGED = 3
+ITEM_FINALIZED = 4
+
+# names of the states, in order
+ITEM_STATES = ["queued", "downloaded", "cover", "tagged", "finalized"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    urls TEXT NOT NULL,
+    started REAL NOT NULL,
+    finished REAL
+);
+CREATE TABLE IF NOT EXISTS items (
+    job INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    title TEXT,
+    state INTEGER NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    path TEXT,
+    updated REAL NOT NULL,
+    PRIMARY KEY (job, key)
+);
+"""
+
+class Journal:
+    """
+    Crash-safe record of how far each item of the current job has got,
+    kept in SQLite so an interrupted job can carry on where it stopped.
+    """
+    _journaldir = os.path.join("config", "journal.db")
+
+    def __init__(self) -> None:
+        """
+        Crash-safe record of how far each item of the current job has got.
+        The database is opened when it is first used.
+        """
+        self.lock = threading.Lock()
+        self.connection:sqlite3.Connection|None = None
+        self.job:int|None = None
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open the database if needed, must hold the lock."""
+        if self.connection is None:
+            directory = os.path.dirname(self._journaldir)
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+
+            # used by the download and post processing threads
+            self.connection = sqlite3.connect(
+                self._journaldir,
+                check_same_thread=False
+            )
+            # every change is committed, the write-ahead log keeps
+            # that cheap and survives the process being killed
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.executescript(SCHEMA)
+
+            # journals made before failed attempts were counted
+            columns = [
+                row[1] for row in
+                self.connection.execute("PRAGMA table_info(items)")
+            ]
+            for column in ["attempts", "failed"]:
+                if column not in columns:
+                    self.connection.execute(
+                        f"ALTER TABLE items ADD COLUMN {column} "
+                        "INTEGER NOT NULL DEFAULT 0"
+                    )
+            self.connection.commit()
+        return self.connection
+
+    def begin(self, urls:list[str]) -> bool:
+        """
+        Start a job, or carry on with the unfinished job for the same URLs.
+        Other unfinished jobs are abandoned.
+
+        :param urls:
+        URLs of the job.
+
+        :returns resumed:
+        `True` if an unfinished job was found.
+        """
+        encoded = json.dumps(urls)
+        with self.lock:
+            db = self._connect()
+            row = db.execute(
+                "SELECT id FROM jobs WHERE finished IS NULL AND urls = ? "
+                "ORDER BY id DESC LIMIT 1",
+                (encoded,)
+            ).fetchone()
+
+            db.execute(
+                "UPDATE jobs SET finished = ? WHERE finished IS NULL "
+                "AND id != ?",
+                (time.time(), -1 if row is None else row[0])
+            )
+            if row is None:
+                cursor = db.execute(
+                    "INSERT INTO jobs (urls, started) VALUES (?, ?)",
+                    (encoded, time.time())
+                )
+                self.job = cursor.lastrowid
+            else:
+                self.job = row[0]
+            db.commit()
+        return row is not None
+
+    def add_items(self, work_list:list[dict[str,typing.Any]]) -> None:
+        """
+        Record the items of the current job, items already
+        in the journal keep their state.
+
+        :param work_list:
+        Work items from the prefetch.
+        """
+        with self.lock:
+            if self.job is None:
+                return
+            db = self._connect()
+            db.executemany(
+                "INSERT OR IGNORE INTO items "
+                "(job, key, position, title, state, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        self.job,
+                        item["key"],
+                        position,
+                        item["title"],
+                        ITEM_FINALIZED if item["archived"] else ITEM_QUEUED,
+                        time.time()
+                    )
+                    for position, item in enumerate(work_list)
+                    if item["key"] is not None
+                ]
+            )
+            db.commit()
+
+    def set_state(self, key:str|None, state:int, path:str|None=None) -> None:
+        """
+        Record that an item of the current job has reached a state.
+        An item never moves back to an earlier state.
+
+        :param key:
+        Archive key of the item.
+
+        :param state:
+        `ITEM_DOWNLOADED`, `ITEM_COVER`, `ITEM_TAGGED` or `ITEM_FINALIZED`
+
+        :param path:
+        Where the audio file is now, if known.
+        """
+        if not ITEM_DOWNLOADED <= state < len(ITEM_STATES):
+            raise ValueError(f"Unknown item state {state}")
+
+        with self.lock:
+            if self.job is None or key is None:
+                return
+            db = self._connect()
+            db.execute(
+                "UPDATE items SET state = MAX(state, ?), "
+                "path = COALESCE(?, path), updated = ? "
+                "WHERE job = ? AND key = ?",
+                (state, path, time.time(), self.job, key)
+            )
+            db.commit()
+
+    def get_state(self, key:str|None) -> int:
+        """
+        :returns state:
+        State of an item of the current job, `ITEM_QUEUED` if unknown.
+        """
+        with self.lock:
+            if self.job is None or key is None:
+                return ITEM_QUEUED
+            row = self._connect().execute(
+                "SELECT state FROM items WHERE job = ? AND key = ?",
+                (self.job, key)
+            ).fetchone()
+        return ITEM_QUEUED if row is None else row[0]
+
+    def is_settled(self, key:str|None) -> bool:
+        """
+        :returns settled:
+        `True` if an item of the current job is finalized,
+        or has failed too many times to be tried again.
+        """
+        with self.lock:
+            if self.job is None or key is None:
+                return False
+            row = self._connect().execute(
+                "SELECT state, failed FROM items WHERE job = ? AND key = ?",
+                (self.job, key)
+            ).fetchone()
+        return row is not None and (row[0] == ITEM_FINALIZED or row[1] == 1)
+
+    def record_attempt(self, max_attempts:int) -> list[str]:
+        """
+        Count a failed attempt for every item of the current job that
+        is not finalized, items that reach the limit are given up on.
+
+        :param max_attempts:
+        Attempts an item gets before it is given up on.
+
+        :returns keys:
+        Keys of the items that may be tried again.
+        """
+        with self.lock:
+            if self.job is None:
+                return []
+            db = self._connect()
+            db.execute(
+                "UPDATE items SET attempts = attempts + 1, "
+                "failed = attempts + 1 >= ?, updated = ? "
+                "WHERE job = ? AND state < ? AND failed = 0",
+                (max_attempts, time.time(), self.job, ITEM_FINALIZED)
+            )
+            db.commit()
+            rows = db.execute(
+                "SELECT key FROM items WHERE job = ? AND state < ? "
+                "AND failed = 0 ORDER BY position",
+                (self.job, ITEM_FINALIZED)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def get_resume_point(self) -> tuple[int,int]:
+        """
+        :returns position, total:
+        Position of the first item of the current job that is not
+        finalized or given up on, counted from 1, and the number of items.
+        """
+        with self.lock:
+            if self.job is None:
+                return 0, 0
+            db = self._connect()
+            total = db.execute(
+                "SELECT COUNT(*) FROM items WHERE job = ?",
+                (self.job,)
+            ).fetchone()[0]
+            row = db.execute(
+                "SELECT MIN(position) FROM items WHERE job = ? AND state < ? "
+                "AND failed = 0",
+                (self.job, ITEM_FINALIZED)
+            ).fetchone()
+        if row[0] is None:
+            return total, total
+        return row[0] + 1, total
+
+    def finish(self) -> None:
+        """Mark the current job as finished, it will not be resumed."""
+        with self.lock:
+            if self.job is None:
+                return
+            db = self._connect()
+            db.execute(
+                "UPDATE jobs SET finished = ? WHERE id = ?",
+                (time.time(), self.job)
+            )
+            db.commit()
+            self.job = None
+
+    def get_unfinished_urls(self) -> list[str]:
+        """
+        :returns urls:
+        URLs of the most recent job that did not finish,
+        empty if every job finished.
+        """
+        with self.lock:
+            row = self._connect().execute(
+                "SELECT urls FROM jobs WHERE finished IS NULL "
+                "ORDER BY id DESC LIMIT 1"
+            ).fetchone()
+        return [] if row is None else json.loads(row[0])
@@ -0,0 +1,54 @@
+import time
+import types
+import importlib
+import threading
+
+class LazyModule:
+    """
+    Stands in for a module that is only imported when it is first used,
+    so heavy libraries do not slow down starting the application.
+    """
+    def __init__(self, name:str) -> None:
+        """
+        Stands in for a module that is only imported when it is first used.
+
+        :param name:
+        Full name of the module, as given to `import`.
+        """
+        self._name = name
+        self._module:types.ModuleType|None = None
+        self._lock = threading.Lock()
+
+    def _load_module(self) -> types.ModuleType:
+        """
+        Import the module if it has not been imported yet.
+
+        :returns module:
+        The imported module.
+        """
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attribute:str) -> object:
+        return getattr(self._load_module(), attribute)
+
+def load_all(modules:list[LazyModule]) -> dict[str,float]:
+    """
+    Import several lazy modules now,
+    used to load them in the background before they are needed.
+
+    :param modules:
+    Modules to import.
+
+    :returns timings:
+    Seconds taken to import each module, by name.
+    """
+    timings = {}
+    for module in modules:
+        start = time.perf_counter()
+        module._load_module() #pylint: disable=W0212
+        timings[module._name] = time.perf_counter() - start #pylint: disable=W0212
+    return timings
@@ -1,11 +1,17 @@
+import time
+# measured before the slow imports below
+STARTED = time.perf_counter()
+
+#pylint: disable=C0411,C0413
 import sys
-import re
 import logging
+import threading
 # from logging.handlers import RotatingFileHandler
 from concurrent_log_handler import ConcurrentRotatingFileHandler
-from PySide6.QtCore import QThread, SignalInstance
+from PySide6.QtCore import QThread, QTimer, SignalInstance
 
 import api
+import progress
 import gui
 
 LOG_FILE = "debug.log"
@@ -16,24 +22,35 @@ class ProgressLogger():
 
     def __init__(self) -> None:
         self.signal = None
+        # several downloads may report at the same time
+        self.lock = threading.RLock()
+        self.tracker = progress.ProgressTracker()
         self.data = {
             "partial": 0,
             "total": 0,
+            "status": "",
             "error": False
         }
-        self.progress = {
-            "to do": 0,
-            "done": 0,
-            "sub to do": 0,
-            "sub done": 0
-        }
 
     def update(self, msg:str) -> None:
         """emit a signal to the ui for a progress update."""
         if self.signal is None:
             return
 
-        self.signal.emit(msg, self.data)
+        self.signal.emit(msg, dict(self.data))
+
+    def progress(self, event:progress.ProgressEvent) -> None:
+        """
+        Progress event from a task, passed on to the ui
+        at most `progress.MAX_UPDATE_RATE` times a second.
+        """
+        with self.lock:
+            if not self.tracker.update(event):
+                return
+            self.data["partial"] = self.tracker.partial
+            self.data["total"] = self.tracker.total
+            self.data["status"] = self.tracker.status
+            self.update(self.tracker.status)
 
     def debug(self, msg:str):
         """debug string"""
@@ -44,83 +61,71 @@ class ProgressLogger():
             pass
         else:
             self.info(msg)
-            self.update(msg)
 
     def info(self, msg:str):
         """info string"""
-        # remove ansi escape sequences
-        done = False
-        msg = re.sub(r"\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])", '', msg)
-        m = msg.split(" ")
-        m = [s for s in m if s != ""]
-
-        # large increments, one for each url in the list
-        if msg.startswith("[mushappy] "):
-            self.progress["to do"] = int(m[-1])
-            self.progress["done"] = int(m[-3])
-            self.progress["sub to do"] = 1
-            self.progress["sub done"] = 0
-
-        elif msg.startswith("[download] "):
-            # smaller increments, one for each item in a url
-            if m[1].lower() == "downloading" and m[2] == "item":
-                self.progress["sub to do"] = int(m[-1]) + 1
-                self.progress["sub done"] = int(m[-3])
-
-            # done, free the UI
-            elif m[1].lower() in ["done"]:
-                self.data["total"] = 100
-                done = True
-
-            # update total number of tasks to do
-            else:
-                try:
-                    self.data["partial"] = int(float(m[1][:-1]))
-                except ValueError:
-                    pass
-
-        if not done:
-            self.data["total"] = self.calculate_progress()
-
         print(msg)
-        self.update(msg)
+        with self.lock:
+            self.set_status(msg)
+            self.update(msg)
 
     def warning(self, msg:str):
         """warning string"""
         print("WARNING: " + msg)
-        self.update(msg)
+        with self.lock:
+            self.set_status(msg)
+            self.update(msg)
 
     def error(self, msg:str):
         """error string"""
         print("ERROR: " + msg)
-        self.data["error"] = True
-        self.update(msg)
+        with self.lock:
+            self.set_status(msg)
+            self.data["error"] = True
+            self.update(msg)
+
+    def set_status(self, msg:str) -> None:
+        """Show a message in the ui without its "[module] " prefix."""
+        if msg.startswith("[") and "] " in msg:
+            msg = msg.split("] ", 1)[1]
+        self.data["status"] = msg
 
     def set_signal(self, signal:SignalInstance) -> None:
         """Set the emission signal."""
         self.signal = signal
 
-    def calculate_progress(self) -> None:
-        """Calculate total progression"""
-        to_do = self.progress["to do"]
-        done = self.progress["done"]
-        sub_to_do = self.progress["sub to do"]
-        sub_done = self.progress["sub done"]
-        return (100 / to_do) * (done + ((sub_done-1)/sub_to_do))
-
     def reset(self) -> None:
         """reset the progress tracker."""
-        self.data = {
-            "partial": 0,
-            "total": 0,
-            "error": False
-        }
-        self.progress = {
-            "to do": 0,
-            "done": 0,
-            "sub to do": 0,
-            "sub done": 0
-        }
+        with self.lock:
+            self.tracker.reset()
+            self.data = {
+                "partial": 0,
+                "total": 0,
+                "status": "",
+                "error": False
+            }
+
+class StartupTimer():
+    """Records how long each step of starting the application takes."""
+
+    def __init__(self, start:float) -> None:
+        self.start = start
+        self.last = start
+        self.steps:list[tuple[str,float]] = []
+
+    def mark(self, step:str) -> None:
+        """Record the end of a step."""
+        now = time.perf_counter()
+        self.steps.append((step, now - self.last))
+        self.last = now
+
+    def report(self) -> str:
+        """Summarise the steps recorded so far."""
+        total = self.last - self.start
+        steps = ", ".join(
+            f"{step} {seconds:.3f}s" for step, seconds in self.steps
+        )
+        return f"[startup] First window after {total:.3f}s ({steps})"
 
 class TaskThreaded(QThread):
     """Threaded task for the UI to run."""
@@ -141,8 +146,21 @@ class TaskThreaded(QThread):
 
     def run(self) -> None:
         """Run MusHappy as a background task."""
+        self.logger.reset()
         self.task.download_and_tag(self.urls)
 
+    def get_download_profiles(self) -> list[str]:
+        """Get the names of the download profiles."""
+        return self.task.get_download_profiles()
+
+    def get_unfinished_urls(self) -> list[str]:
+        """Get the URLs of an interrupted download."""
+        return self.task.get_unfinished_urls()
+
+    def load_libraries(self) -> dict[str,float]:
+        """Import the libraries used by the task."""
+        return self.task.load_libraries()
+
     def get_valid_ai_models(self) -> list[str]:
         """Get available ai models."""
         return self.task.get_valid_ai_models()
@@ -179,11 +197,48 @@ def main():
 
     sys.excepthook = handle_exception
 
+    timer = StartupTimer(STARTED)
+    timer.mark("imports")
+
     theme_name = None
     if len(sys.argv) > 1:
         theme_name = sys.argv[1]
-    app, window = gui.create_ui(TaskThreaded(), theme_name)
+    task = TaskThreaded()
+    timer.mark("task")
+    app, window = gui.create_ui(task, theme_name)
     window.update_widgets()
+    window.offer_resume()
+    timer.mark("window")
+
+    def load_libraries():
+        """import the libraries while the window is idle"""
+        start = time.perf_counter()
+        timings = task.load_libraries()
+
+        # the model executables are probed here rather than while
+        # the window is built
+        probe = time.perf_counter()
+        window.ai_models_found.emit(task.get_valid_ai_models())
+        timings["ai models"] = time.perf_counter() - probe
+
+        libraries = ", ".join(
+            f"{name} {seconds:.3f}s" for name, seconds in timings.items()
+        )
+        message = (
+            "[startup] Libraries loaded in the background after "
+            f"{time.perf_counter() - start:.3f}s ({libraries})"
+        )
+        print(message)
+        logger.info(message)
+
+    def first_event():
+        """runs once the window is handling events"""
+        timer.mark("first event")
+        print(timer.report())
+        logger.info(timer.report())
+        threading.Thread(target=load_libraries, daemon=True).start()
+
+    QTimer.singleShot(0, first_event)
     ret = app.exec()
 
     if ret != 0:
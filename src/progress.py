@@ -0,0 +1,214 @@
+import time
+import typing
+
+# stages of a progress event
+STAGE_DOWNLOAD = "download"
+STAGE_CONVERT = "convert"
+STAGE_FINISHED = "finished"
+STAGE_FAILED = "failed"
+STAGE_TOTAL = "total"
+STAGE_DONE = "done"
+
+# share of an item that is complete once it reaches a stage,
+# the rest is complete after tagging
+DOWNLOAD_WEIGHT = 0.8
+CONVERT_WEIGHT = 0.9
+
+# events are passed on at most this many times a second
+MAX_UPDATE_RATE = 10
+
+class ProgressEvent:
+    """Progress of a single item or of the whole job."""
+
+    def __init__(
+            self,
+            item_id:str,
+            stage:str,
+            title:str="",
+            bytes_done:int=0,
+            bytes_total:int|None=None,
+            speed:float|None=None,
+            eta:float|None=None,
+            items_done:int=0,
+            items_total:int=0
+        ) -> None:
+        """
+        Progress of a single item or of the whole job.
+
+        :param item_id:
+        Archive key of the item, empty for the whole job.
+
+        :param stage:
+        One of `STAGE_DOWNLOAD`, `STAGE_CONVERT`, `STAGE_FINISHED`,
+        `STAGE_FAILED`, `STAGE_TOTAL` or `STAGE_DONE`.
+
+        :param title:
+        Title of the item.
+
+        :param bytes_done:
+        Bytes downloaded so far.
+
+        :param bytes_total:
+        Size of the download, `None` if unknown.
+
+        :param speed:
+        Download speed in bytes per second, `None` if unknown.
+
+        :param eta:
+        Seconds until the download finishes, `None` if unknown.
+
+        :param items_done:
+        Items finished, only used by `STAGE_TOTAL`.
+
+        :param items_total:
+        Items in the job, only used by `STAGE_TOTAL`.
+        """
+        self.item_id = item_id
+        self.stage = stage
+        self.title = title
+        self.bytes_done = bytes_done
+        self.bytes_total = bytes_total
+        self.speed = speed
+        self.eta = eta
+        self.items_done = items_done
+        self.items_total = items_total
+
+    def get_fraction(self) -> float:
+        """
+        :returns fraction:
+        How much of the download is done, between `0` and `1`.
+        """
+        if not self.bytes_total:
+            return 0.0
+        return min(self.bytes_done / self.bytes_total, 1.0)
+
+    def to_dict(self) -> dict[str,typing.Any]:
+        """
+        :returns event:
+        The event as a dictionary that can be written as JSON.
+        """
+        return dict(vars(self))
+
+    def describe(self) -> str:
+        """
+        :returns text:
+        Short human readable description of the event.
+        """
+        match self.stage:
+            case "download":
+                text = f"Downloading {self.title}"
+                if self.bytes_total:
+                    text += f" {self.get_fraction():.0%}"
+                if self.speed:
+                    text += f" at {self.speed / 1e6:.1f} MB/s"
+                if self.eta is not None:
+                    text += f", {int(self.eta)}s left"
+                return text
+            case "convert":
+                return f"Converting {self.title}"
+            case "finished":
+                return f"Finished {self.title}"
+            case "failed":
+                return f"Failed {self.title}"
+            case "total":
+                return f"Finished {self.items_done} of {self.items_total}"
+            case _:
+                return "Done"
+
+class ProgressTracker:
+    """
+    Combines progress events into the values shown by the progress bars,
+    and limits how often they need to be shown.
+    """
+
+    def __init__(
+            self,
+            max_rate:float=MAX_UPDATE_RATE,
+            clock:typing.Callable[[],float]=time.monotonic
+        ) -> None:
+        """
+        Combines progress events into the values shown by the progress bars.
+
+        :param max_rate:
+        Most updates per second, events in between are only recorded.
+
+        :param clock:
+        Returns the current time in seconds.
+        """
+        self.interval = 1 / max_rate
+        self.clock = clock
+        self.last_update = None
+        self.items:dict[str,float] = {}
+        self.items_done = 0
+        self.items_total = 0
+        self.partial = 0
+        self.total = 0
+        self.status = ""
+
+    def reset(self) -> None:
+        """Forget the progress of the previous job."""
+        self.last_update = None
+        self.items = {}
+        self.items_done = 0
+        self.items_total = 0
+        self.partial = 0
+        self.total = 0
+        self.status = ""
+
+    def update(self, event:ProgressEvent) -> bool:
+        """
+        Record a progress event.
+
+        :param event:
+        The event to record.
+
+        :returns due:
+        `True` if an update should be shown now. Download progress is
+        limited to `max_rate` once an item has started,
+        other stages are always shown.
+        """
+        started = event.item_id not in self.items
+        match event.stage:
+            case "download":
+                fraction = event.get_fraction()
+                self.items[event.item_id] = fraction * DOWNLOAD_WEIGHT
+                self.partial = int(fraction * 100)
+            case "convert":
+                self.items[event.item_id] = CONVERT_WEIGHT
+                self.partial = 100
+            case "finished" | "failed":
+                self.items.pop(event.item_id, None)
+            case "total":
+                self.items_done = event.items_done
+                self.items_total = max(self.items_total, event.items_total)
+            case "done":
+                self.items = {}
+                self.partial = 100
+        self.status = event.describe()
+
+        if event.stage == STAGE_DONE:
+            self.total = 100
+        else:
+            # never let the total bar move backwards
+            self.total = max(self.total, self.calculate_total())
+
+        now = self.clock()
+        due = event.stage != STAGE_DOWNLOAD \
+            or started \
+            or event.get_fraction() >= 1.0 \
+            or self.last_update is None \
+            or now - self.last_update >= self.interval
+        if due:
+            self.last_update = now
+        return due
+
+    def calculate_total(self) -> int:
+        """
+        :returns total:
+        Progress of the whole job as a percentage, finished items count
+        in full and items in progress count by their stage.
+        """
+        if self.items_total == 0:
+            return 0
+        done = self.items_done + sum(self.items.values())
+        return int(min(100 / self.items_total * done, 99))
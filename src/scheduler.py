@@ -0,0 +1,298 @@
+import re
+import time
+import typing
+import threading
+import urllib.parse
+import configure
+from handler import DEBUG, INFO, WARNING, ERROR #pylint: disable=W0611
+
+# http status codes sent by hosts that want fewer requests
+THROTTLE_STATUS = [429, 503]
+# yt-dlp only keeps the status in the message of some errors,
+# bare numbers are not matched as ids often contain them
+THROTTLE_MESSAGE = re.compile(
+    r"http error (429|503)\b|too many requests|rate[ -]limit"
+)
+
+T = typing.TypeVar("T")
+
+def is_throttled(error:BaseException) -> bool:
+    """
+    Check if an error means the host is limiting requests.
+    The errors yt-dlp wraps around the HTTP error are followed.
+
+    :param error:
+    The error raised while downloading.
+
+    :returns throttled:
+    `True` for HTTP 429 and 503, or a message saying so.
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        status = getattr(error, "status", None) or getattr(error, "code", None)
+        if status in THROTTLE_STATUS:
+            return True
+        if THROTTLE_MESSAGE.search(str(error).lower()):
+            return True
+
+        # yt-dlp keeps the original error in exc_info
+        exc_info = getattr(error, "exc_info", None)
+        if exc_info and isinstance(exc_info, tuple) and len(exc_info) > 1:
+            error = exc_info[1]
+        else:
+            error = error.__cause__ or error.__context__
+    return False
+
+def get_host(url:str) -> str:
+    """
+    :returns host:
+    Host name of a URL without a leading `www.`, or the URL itself
+    if it has no host.
+    """
+    host = urllib.parse.urlsplit(url).hostname or url
+    return host.removeprefix("www.")
+
+class TokenBucket:
+    """Paces requests to an average rate, allowing short bursts."""
+
+    def __init__(
+            self,
+            rate:float,
+            burst:float,
+            clock:typing.Callable[[],float]=time.monotonic
+        ) -> None:
+        """
+        Paces requests to an average rate, allowing short bursts.
+
+        :param rate:
+        Requests per second, `0` for no limit.
+
+        :param burst:
+        Requests allowed at once after being idle.
+
+        :param clock:
+        Returns the current time in seconds.
+        """
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.clock = clock
+        self.tokens = self.burst
+        self.last = clock()
+
+    def reserve(self) -> float:
+        """
+        Take a token, must not be called by two threads at once.
+
+        :returns delay:
+        Seconds to wait before making the request.
+        """
+        if self.rate <= 0:
+            return 0.0
+
+        now = self.clock()
+        self.tokens = min(
+            self.burst,
+            self.tokens + (now - self.last) * self.rate
+        )
+        self.last = now
+
+        # tokens may go below zero, later requests then queue behind
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+class HostState:
+    """Limits and throttling history of a single host."""
+
+    def __init__(self, limit:int, bucket:TokenBucket) -> None:
+        self.cap = limit
+        self.limit = limit
+        self.active = 0
+        self.successes = 0
+        self.cooldown_until = 0.0
+        self.bucket = bucket
+
+class DownloadScheduler:
+    """
+    Decides when each URL may start downloading.
+    Each host and extractor has a cap on concurrent downloads,
+    requests to a host are paced by a token bucket, and a host that
+    throttles is backed off and given fewer concurrent downloads,
+    which grow back as downloads succeed.
+    """
+
+    def __init__(
+            self,
+            config:configure.Config,
+            log:typing.Callable[[str,int],None]|None=None,
+            clock:typing.Callable[[],float]=time.monotonic,
+            sleep:typing.Callable[[float],None]=time.sleep
+        ) -> None:
+        """
+        Decides when each URL may start downloading.
+
+        :param config:
+        Download configuration with the scheduler settings.
+
+        :param log:
+        Called with a message and a level, as `BaseHandler.log`.
+
+        :param clock:
+        Returns the current time in seconds.
+
+        :param sleep:
+        Waits a number of seconds.
+        """
+        self.config = config
+        self.log = log
+        self.clock = clock
+        self.sleep = sleep
+
+        self.condition = threading.Condition()
+        self.hosts:dict[str,HostState] = {}
+        self.extractors:dict[str,int] = {}
+
+    def reset(self) -> None:
+        """Forget the hosts, so changed settings are used."""
+        with self.condition:
+            self.hosts = {}
+            self.extractors = {}
+
+    def run(
+            self,
+            url:str,
+            extractor:str|None,
+            action:typing.Callable[[],T]
+        ) -> T:
+        """
+        Run a download when its host and extractor allow it,
+        retrying with backoff while the host is throttling.
+
+        :param url:
+        The URL being downloaded.
+
+        :param extractor:
+        Name of the extractor for the URL, if known.
+
+        :param action:
+        Downloads the URL.
+
+        :returns result:
+        Whatever `action` returned.
+        """
+        host = get_host(url)
+        retries = int(self.config.get_value("throttle_retries"))
+        attempt = 0
+        while True:
+            delay = self._acquire(host, extractor)
+            if delay > 0:
+                self.sleep(delay)
+
+            try:
+                result = action()
+            except Exception as e:
+                throttled = is_throttled(e)
+                self._release(host, extractor, throttled, attempt)
+                if not throttled or attempt >= retries:
+                    raise
+                attempt += 1
+                continue
+
+            self._release(host, extractor, False, attempt)
+            return result
+
+    def _get_host(self, host:str) -> HostState:
+        """Get the state of a host, must hold the condition."""
+        if host not in self.hosts:
+            limit = max(1, int(self.config.get_value("max_downloads_per_host")))
+            bucket = TokenBucket(
+                float(self.config.get_value("host_requests_per_second")),
+                float(self.config.get_value("host_request_burst")),
+                self.clock
+            )
+            self.hosts[host] = HostState(limit, bucket)
+        return self.hosts[host]
+
+    def _get_extractor_cap(self, extractor:str|None) -> int:
+        """
+        :returns cap:
+        Most concurrent downloads for an extractor, `0` for no cap.
+        """
+        caps = self.config.get_value("max_downloads_per_extractor") or {}
+        if extractor is None:
+            return 0
+        return int(caps.get(extractor, 0))
+
+    def _acquire(self, host:str, extractor:str|None) -> float:
+        """
+        Wait for a free slot on the host and extractor.
+
+        :returns delay:
+        Seconds to wait before starting, for pacing or backoff.
+        """
+        cap = self._get_extractor_cap(extractor)
+        with self.condition:
+            state = self._get_host(host)
+            while state.active >= state.limit or (
+                cap > 0 and self.extractors.get(extractor, 0) >= cap
+            ):
+                self.condition.wait()
+
+            state.active += 1
+            if extractor is not None:
+                self.extractors[extractor] = \
+                    self.extractors.get(extractor, 0) + 1
+
+            delay = state.bucket.reserve()
+            return max(delay, state.cooldown_until - self.clock())
+
+    def _release(
+            self,
+            host:str,
+            extractor:str|None,
+            throttled:bool,
+            attempt:int
+        ) -> None:
+        """
+        Free the slot of a finished download and adapt the host limit.
+
+        :param throttled:
+        `True` if the host limited the download.
+
+        :param attempt:
+        Number of times the download has been throttled before.
+        """
+        with self.condition:
+            state = self.hosts[host]
+            state.active -= 1
+            if extractor is not None:
+                self.extractors[extractor] -= 1
+
+            if throttled:
+                base = float(self.config.get_value("throttle_backoff"))
+                longest = float(self.config.get_value("throttle_backoff_max"))
+                backoff = min(base * 2 ** attempt, longest)
+                state.cooldown_until = max(
+                    state.cooldown_until,
+                    self.clock() + backoff
+                )
+                # halve the concurrent downloads, grow them back slowly
+                state.limit = max(1, state.limit // 2)
+                state.successes = 0
+                message = (
+                    f"[scheduler] {host} is throttling, waiting "
+                    f"{backoff:.0f}s with {state.limit} download(s) at once"
+                )
+            else:
+                state.successes += 1
+                message = None
+                if state.successes >= state.limit and state.limit < state.cap:
+                    state.limit += 1
+                    state.successes = 0
+
+            self.condition.notify_all()
+
+        if message is not None and self.log is not None:
+            self.log(message, WARNING)
@@ -0,0 +1,659 @@
+import os
+import sys
+import hmac
+import json
+import time
+import uuid
+import typing
+import secrets
+import argparse
+import threading
+import traceback
+import http.server
+import urllib.parse
+
+import api
+import cli
+import configure
+import progress
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_FINISHED = "finished"
+JOB_FAILED = "failed"
+
+# finished jobs kept in the job file, older ones are forgotten
+MAX_FINISHED_JOBS = 100
+
+# seconds between blank lines sent to idle event streams,
+# so a closed connection is noticed
+KEEPALIVE_INTERVAL = 15
+
+# host names that always reach this computer
+LOCAL_HOSTS = ["127.0.0.1", "localhost", "::1"]
+
+class ServiceConfig(configure.Config):
+    """
+    Configuration of the service, holds the token every request
+    must carry. The token is created when the file is first made.
+    """
+    def __init__(self) -> None:
+        """
+        Import configuration from the config json file if it exists,
+        otherwise create one.
+        """
+        self._configdir = os.path.join("config", "service.json")
+        super().__init__()
+
+    def default(self) -> None:
+        """Load the default configuration."""
+        self.config = {
+            "token": secrets.token_urlsafe(24)
+        }
+
+class JobQueue:
+    """
+    Persistent list of jobs, kept in a json file
+    so queued jobs survive a restart.
+    """
+    _jobsdir = os.path.join("config", "jobs.json")
+
+    def __init__(self) -> None:
+        """
+        Import the jobs from the json file if it exists.
+        """
+        self.lock = threading.Lock()
+        self.jobs:dict[str,dict[str,typing.Any]] = {}
+        self.load()
+
+    def load(self) -> None:
+        """Import the jobs from the json file."""
+        if not os.path.exists(self._jobsdir):
+            return
+
+        try:
+            with open(self._jobsdir, "r", encoding="utf-8") as f:
+                self.jobs = json.load(f)
+        except (OSError, ValueError):
+            self.jobs = {}
+
+        # jobs cut short by a restart are run again
+        for job in self.jobs.values():
+            if job["status"] == JOB_RUNNING:
+                job["status"] = JOB_QUEUED
+
+    def save(self) -> None:
+        """Export the jobs to the json file, must hold the lock."""
+        finished = [
+            job for job in self.jobs.values()
+            if job["status"] in [JOB_FINISHED, JOB_FAILED]
+        ]
+        finished.sort(key=lambda job: job["finished"])
+        for job in finished[:-MAX_FINISHED_JOBS]:
+            del self.jobs[job["id"]]
+
+        # write a copy first so a crash cannot leave a partial file
+        temp_path = self._jobsdir + ".tmp"
+        with open(temp_path, "w+", encoding="utf-8") as f:
+            json.dump(self.jobs, f, indent=4)
+        os.replace(temp_path, self._jobsdir)
+
+    def add(self, urls:list[str]) -> dict[str,typing.Any]:
+        """
+        Queue a new job.
+
+        :param urls:
+        URLs to download.
+
+        :returns job:
+        The queued job.
+        """
+        job = {
+            "id": uuid.uuid4().hex,
+            "urls": urls,
+            "status": JOB_QUEUED,
+            "created": time.time(),
+            "started": None,
+            "finished": None,
+            "summary": None
+        }
+        with self.lock:
+            self.jobs[job["id"]] = job
+            self.save()
+        return dict(job)
+
+    def get(self, job_id:str) -> dict[str,typing.Any]|None:
+        """
+        :returns job:
+        A copy of the job or `None` if there is no such job.
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return None if job is None else dict(job)
+
+    def get_all(self) -> list[dict[str,typing.Any]]:
+        """
+        :returns jobs:
+        Copies of every job, oldest first, without their summaries.
+        """
+        with self.lock:
+            jobs = [dict(job, summary=None) for job in self.jobs.values()]
+        jobs.sort(key=lambda job: job["created"])
+        return jobs
+
+    def take_next(self) -> dict[str,typing.Any]|None:
+        """
+        Mark the oldest queued job as running.
+
+        :returns job:
+        A copy of the job or `None` if nothing is queued.
+        """
+        with self.lock:
+            queued = [
+                job for job in self.jobs.values()
+                if job["status"] == JOB_QUEUED
+            ]
+            if len(queued) == 0:
+                return None
+
+            job = min(queued, key=lambda job: job["created"])
+            job["status"] = JOB_RUNNING
+            job["started"] = time.time()
+            self.save()
+            return dict(job)
+
+    def finish(
+            self,
+            job_id:str,
+            summary:dict[str,typing.Any],
+            failed:bool
+        ) -> dict[str,typing.Any]:
+        """
+        Record the outcome of a job.
+
+        :param job_id:
+        The job that ran.
+
+        :param summary:
+        Summary from `cli.summarise`.
+
+        :param failed:
+        `True` if any item failed.
+
+        :returns job:
+        A copy of the finished job.
+        """
+        with self.lock:
+            job = self.jobs[job_id]
+            job["status"] = JOB_FAILED if failed else JOB_FINISHED
+            job["finished"] = time.time()
+            job["summary"] = summary
+            self.save()
+            return dict(job)
+
+class ServiceLogger(cli.CliLogger):
+    """
+    Records the progress of the running job
+    and wakes the clients streaming its events.
+    """
+
+    def __init__(self, quiet:bool=False) -> None:
+        super().__init__(quiet)
+        self.condition = threading.Condition(self.lock)
+        self.tracker = progress.ProgressTracker()
+        self.job_id:str|None = None
+        # events of each job since the service started
+        self.events:dict[str,list[dict[str,typing.Any]]] = {}
+
+    def begin(self, job_id:str) -> None:
+        """Start recording a new job."""
+        with self.lock:
+            self.job_id = job_id
+            self.warnings = []
+            self.stages = {}
+            self.tracker.reset()
+            self.events[job_id] = []
+            # forget the events of the oldest jobs
+            while len(self.events) > MAX_FINISHED_JOBS:
+                del self.events[next(iter(self.events))]
+
+    def end(self, job:dict[str,typing.Any]) -> None:
+        """Stop recording and send the finished job to the clients."""
+        with self.lock:
+            self.job_id = None
+            self.events.setdefault(job["id"], []).append(
+                {"type": "job", "job": job}
+            )
+            self.condition.notify_all()
+
+    def warning(self, msg:str):
+        """warning string"""
+        super().warning(msg)
+        self._send({"type": "warning", "message": msg})
+
+    def error(self, msg:str):
+        """error string"""
+        super().error(msg)
+        self._send({"type": "error", "message": msg})
+
+    def progress(self, event:progress.ProgressEvent) -> None:
+        """Record an event, download progress is limited in rate."""
+        super().progress(event)
+        with self.lock:
+            if not self.tracker.update(event):
+                return
+        self._send(dict(event.to_dict(), type="progress"))
+
+    def _send(self, event:dict[str,typing.Any]) -> None:
+        """Add an event to the running job and wake the clients."""
+        with self.lock:
+            if self.job_id is None:
+                return
+            self.events[self.job_id].append(event)
+            self.condition.notify_all()
+
+class Service:
+    """
+    Keeps `MusHappy` loaded between jobs and runs the queued jobs
+    one at a time, so its yt-dlp instances stay warm.
+    """
+
+    def __init__(self, quiet:bool=False) -> None:
+        self.logger = ServiceLogger(quiet)
+        self.task = api.MusHappy()
+        # after the handlers, which create the config directory
+        self.jobs = JobQueue()
+        self.task.set_logger(self.logger)
+        self.wake = threading.Event()
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        # called if the service cannot run jobs, to stop accepting them
+        self.on_fatal:typing.Callable[[],None]|None = None
+        self.failed = False
+
+    def start(self) -> None:
+        """Start running jobs in the background."""
+        self.worker.start()
+
+    def submit(self, urls:list[str]) -> dict[str,typing.Any]:
+        """
+        Queue a job.
+
+        :param urls:
+        URLs to download.
+
+        :returns job:
+        The queued job.
+        """
+        job = self.jobs.add(urls)
+        self.wake.set()
+        return job
+
+    def run(self) -> None:
+        """Run queued jobs until the service stops."""
+        try:
+            timings = self.task.load_libraries()
+        except Exception: #pylint: disable=W0718
+            self.logger.error(
+                "[service] Could not load the libraries, stopping\n"
+                + traceback.format_exc()
+            )
+            self.failed = True
+            if self.on_fatal is not None:
+                self.on_fatal()
+            return
+        self.logger.info(
+            "[service] Libraries loaded in "
+            f"{sum(timings.values()):.3f}s"
+        )
+
+        while True:
+            job = None
+            try:
+                job = self.jobs.take_next()
+                if job is None:
+                    self.wake.wait()
+                    self.wake.clear()
+                    continue
+                self.run_job(job)
+            except Exception as e: #pylint: disable=W0718
+                # a broken job must not stop the jobs after it
+                self.logger.error(
+                    f"[service] Job failed: {type(e).__name__}: {e}\n"
+                    + traceback.format_exc()
+                )
+                if job is not None:
+                    self.abandon_job(job, e)
+
+    def abandon_job(self, job:dict[str,typing.Any], error:Exception) -> None:
+        """
+        Mark a job that could not be run as failed,
+        and end its event stream.
+
+        :param job:
+        The job that was running.
+
+        :param error:
+        The exception that stopped it.
+        """
+        summary = {"error": f"{type(error).__name__}: {error}"}
+        try:
+            job = self.jobs.finish(job["id"], summary, True)
+        except Exception: #pylint: disable=W0718
+            # the job is marked failed even if it could not be saved
+            job = self.jobs.get(job["id"]) or job
+        self.logger.end(job)
+
+    def run_job(self, job:dict[str,typing.Any]) -> None:
+        """Run a single job and record its summary."""
+        self.logger.info(f"[service] Starting job {job['id']}")
+        self.logger.begin(job["id"])
+
+        error = None
+        start = time.perf_counter()
+        try:
+            self.task.download_and_tag(job["urls"])
+        except Exception as e: #pylint: disable=W0718
+            error = e
+        summary = cli.summarise(
+            self.task,
+            self.logger,
+            time.perf_counter() - start,
+            error
+        )
+
+        failed = error is not None or summary["failed"] > 0
+        job = self.jobs.finish(job["id"], summary, failed)
+        self.logger.end(job)
+        self.logger.info(f"[service] Job {job['id']} {job['status']}")
+
+    def stream(self, job_id:str) -> typing.Iterator[dict[str,typing.Any]|None]:
+        """
+        Follow the events of a job until it has finished.
+
+        :param job_id:
+        The job to follow.
+
+        :returns events:
+        Events as they happen, `None` when there has been
+        nothing to send for a while.
+        """
+        index = 0
+        while True:
+            job = self.jobs.get(job_id)
+            if job is None or job_id not in self.logger.events \
+                    and job["status"] in [JOB_FINISHED, JOB_FAILED]:
+                # finished before the service started
+                yield {"type": "job", "job": job}
+                return
+
+            with self.logger.condition:
+                events = self.logger.events.get(job_id, [])
+                if index >= len(events):
+                    self.logger.condition.wait(KEEPALIVE_INTERVAL)
+                    events = self.logger.events.get(job_id, [])
+                new = events[index:]
+                index += len(new)
+
+            if len(new) == 0:
+                yield None
+                continue
+
+            for event in new:
+                yield event
+                if event["type"] == "job":
+                    return
+
+def get_hostname(value:str) -> str:
+    """
+    :returns hostname:
+    Host name of a `Host` header or origin, lower case and without the
+    port or the brackets of an IPv6 address, empty if there is none.
+    """
+    if "//" not in value:
+        value = "//" + value
+    try:
+        return urllib.parse.urlsplit(value).hostname or ""
+    except ValueError:
+        return ""
+
+class ServiceRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    HTTP API of the service.
+
+    `POST /jobs` queues the URLs in the body, as a json object
+    `{"urls": [...]}` or as plain text with one URL per line.
+    `GET /jobs` lists the jobs, `GET /jobs/<id>` gets one with its summary
+    and `GET /jobs/<id>/events` streams its events as json lines.
+    `GET /add?url=<url>` queues a single URL, for a bookmarklet.
+
+    Every request must carry the token from `config/service.json`, as
+    `Authorization: Bearer <token>` or `?token=<token>`. Requests for
+    a host other than this computer or from a web page of another site
+    are refused, so other sites cannot queue jobs or read them.
+    """
+    server:"ServiceServer"
+
+    def check_request(self) -> bool:
+        """
+        Refuse requests that did not come from a client of this computer
+        that knows the token.
+
+        :returns allowed:
+        `True` if the request may be handled, otherwise a 403 response
+        has been sent.
+        """
+        # a foreign host name means the request came through dns rebinding
+        host = get_hostname(self.headers.get("Host") or "")
+        if host not in self.server.hosts:
+            self.send_json(403, {"error": "host not allowed"})
+            return False
+
+        # browsers send an origin with requests made by web pages
+        origin = self.headers.get("Origin")
+        if origin is not None \
+                and get_hostname(origin) not in self.server.hosts:
+            self.send_json(403, {"error": "origin not allowed"})
+            return False
+
+        token = ""
+        authorization = self.headers.get("Authorization") or ""
+        if authorization.startswith("Bearer "):
+            token = authorization.removeprefix("Bearer ").strip()
+        else:
+            token = self.get_query().get("token", [""])[0]
+        if not hmac.compare_digest(token.encode(), self.server.token.encode()):
+            self.send_json(403, {"error": "missing or wrong token"})
+            return False
+        return True
+
+    def get_query(self) -> dict[str,list[str]]:
+        """Get the values of the query string, by name."""
+        return urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+
+    def do_GET(self) -> None: #pylint: disable=C0103
+        """Handle GET requests."""
+        if not self.check_request():
+            return
+
+        parts = [part for part in self.path.split("?")[0].split("/") if part]
+        service = self.server.service
+
+        if parts == ["add"]:
+            # opened as a new page by the bookmarklet
+            urls = [url.strip() for url in self.get_query().get("url", [])]
+            urls = [url for url in urls if url != ""]
+            if len(urls) == 0:
+                self.send_json(400, {"error": "no urls given"})
+                return
+            self.send_json(201, service.submit(urls))
+            return
+
+        if parts == ["jobs"]:
+            self.send_json(200, service.jobs.get_all())
+            return
+
+        if len(parts) in [2, 3] and parts[0] == "jobs":
+            job = service.jobs.get(parts[1])
+            if job is None:
+                self.send_json(404, {"error": "no such job"})
+            elif len(parts) == 2:
+                self.send_json(200, job)
+            elif parts[2] == "events":
+                self.send_events(parts[1])
+            else:
+                self.send_json(404, {"error": "not found"})
+            return
+
+        self.send_json(404, {"error": "not found"})
+
+    def do_POST(self) -> None: #pylint: disable=C0103
+        """Handle POST requests."""
+        if not self.check_request():
+            return
+
+        parts = [part for part in self.path.split("?")[0].split("/") if part]
+        if parts != ["jobs"]:
+            self.send_json(404, {"error": "not found"})
+            return
+
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length).decode("utf-8")
+        try:
+            urls = self.parse_urls(body)
+        except (ValueError, TypeError, KeyError):
+            self.send_json(400, {"error": "expected a list of urls"})
+            return
+
+        if len(urls) == 0:
+            self.send_json(400, {"error": "no urls given"})
+            return
+
+        job = self.server.service.submit(urls)
+        self.send_json(201, job)
+
+    def parse_urls(self, body:str) -> list[str]:
+        """
+        Read the URLs of a new job.
+
+        :param body:
+        Request body.
+
+        :returns urls:
+        The URLs, blank lines are skipped.
+        """
+        if self.headers.get_content_type() == "application/json":
+            urls = json.loads(body)["urls"]
+            if not isinstance(urls, list) \
+                    or not all(isinstance(url, str) for url in urls):
+                raise TypeError("urls must be a list of strings")
+        else:
+            urls = body.splitlines()
+        urls = [url.strip() for url in urls]
+        return [url for url in urls if url != ""]
+
+    def send_json(self, code:int, data:typing.Any) -> None:
+        """Send a json response."""
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_events(self, job_id:str) -> None:
+        """Stream the events of a job as json lines until it finishes."""
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        # the length is unknown, the stream ends when the connection closes
+        self.close_connection = True
+
+        try:
+            for event in self.server.service.stream(job_id):
+                line = "" if event is None else json.dumps(event)
+                self.wfile.write(line.encode("utf-8") + b"\n")
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # the client stopped listening
+            pass
+
+class ServiceServer(http.server.ThreadingHTTPServer):
+    """HTTP server with access to the service."""
+    daemon_threads = True
+
+    def __init__(
+            self,
+            address:tuple[str,int],
+            service:Service,
+            token:str
+        ) -> None:
+        """
+        HTTP server with access to the service.
+
+        :param address:
+        Address and port to listen on.
+
+        :param service:
+        The service running the jobs.
+
+        :param token:
+        Token every request must carry.
+        """
+        super().__init__(address, ServiceRequestHandler)
+        self.service = service
+        self.token = token
+        # the listening address is allowed too, when it is not local
+        self.hosts = LOCAL_HOSTS + [get_hostname(address[0])]
+
+    def get_bookmarklet(self) -> str:
+        """
+        :returns bookmarklet:
+        Link that sends the page open in the browser to the service.
+        """
+        host, port = self.server_address[:2]
+        if host in ["0.0.0.0", "::"]:
+            host = "127.0.0.1"
+        if ":" in host:
+            host = f"[{host}]"
+        return (
+            "javascript:void(window.open("
+            f"'http://{host}:{port}/add?token={self.token}&url='"
+            "+encodeURIComponent(location.href)))"
+        )
+
+def main() -> int:
+    """Run the service until interrupted."""
+    parser = argparse.ArgumentParser(
+        description="Keep MusiGui loaded and run download jobs sent to "
+        "a local HTTP API."
+    )
+    parser.add_argument("--host", default="127.0.0.1",
+        help="address to listen on, only this computer by default")
+    parser.add_argument("--port", type=int, default=8765,
+        help="port to listen on")
+    parser.add_argument("-q", "--quiet", action="store_true",
+        help="only print warnings and errors")
+    args = parser.parse_args()
+
+    service = Service(args.quiet)
+    token = ServiceConfig().get_value("token")
+    with ServiceServer((args.host, args.port), service, token) as server:
+        service.on_fatal = server.shutdown
+        service.start()
+        print(
+            f"[service] Listening on http://{args.host}:{args.port}",
+            file=sys.stderr
+        )
+        print(
+            f"[service] Bookmarklet: {server.get_bookmarklet()}",
+            file=sys.stderr
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    return 1 if service.failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
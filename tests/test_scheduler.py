@@ -0,0 +1,154 @@
+import os
+import sys
+import threading
+import unittest
+import http.server
+import urllib.error
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+#pylint: disable=C0413
+import configure
+import scheduler
+
+class SchedulerConfig(configure.Config):
+    """Scheduler settings kept in memory rather than a config file."""
+
+    def __init__(self, **values) -> None: #pylint: disable=W0231
+        self.config = {
+            "max_downloads_per_host": 4,
+            "max_downloads_per_extractor": {},
+            "host_requests_per_second": 0,
+            "host_request_burst": 1,
+            "throttle_retries": 3,
+            "throttle_backoff": 5,
+            "throttle_backoff_max": 300
+        }
+        self.config.update(values)
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    """Answers each request with the next status of the server."""
+
+    def do_GET(self): #pylint: disable=C0103
+        """Send the next status, 200 once they run out."""
+        with self.server.lock:
+            self.server.requests += 1
+            status = self.server.statuses.pop(0) \
+                if len(self.server.statuses) > 0 else 200
+        self.send_response(status)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, format, *args): #pylint: disable=W0622
+        """Keep the test output quiet."""
+
+class SchedulerTest(unittest.TestCase):
+    """Runs the scheduler against a local HTTP stand-in for a host."""
+
+    def setUp(self) -> None:
+        self.server = http.server.ThreadingHTTPServer(
+            ("127.0.0.1", 0),
+            StandInHandler
+        )
+        self.server.lock = threading.Lock()
+        self.server.statuses = []
+        self.server.requests = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/track"
+
+        # time only moves when the scheduler sleeps
+        self.now = 0.0
+        self.sleeps = []
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def clock(self) -> float:
+        """Fake clock for the scheduler."""
+        return self.now
+
+    def sleep(self, seconds:float) -> None:
+        """Fake sleep that moves the clock on."""
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def make_scheduler(self, **values) -> scheduler.DownloadScheduler:
+        """Create a scheduler with the fake clock."""
+        return scheduler.DownloadScheduler(
+            SchedulerConfig(**values),
+            clock=self.clock,
+            sleep=self.sleep
+        )
+
+    def fetch(self) -> bytes:
+        """Download from the stand-in."""
+        with urllib.request.urlopen(self.url, timeout=5) as response:
+            return response.read()
+
+    def test_throttled_host_is_retried_with_backoff(self) -> None:
+        self.server.statuses = [429, 429]
+        sched = self.make_scheduler()
+
+        self.assertEqual(sched.run(self.url, None, self.fetch), b"ok")
+        self.assertEqual(self.server.requests, 3)
+        self.assertEqual(self.sleeps, [5, 10])
+
+        # halved twice, then grown by the success
+        state = sched.hosts["127.0.0.1"]
+        self.assertEqual(state.limit, 2)
+        self.assertEqual(state.active, 0)
+
+    def test_limit_grows_back_after_successes(self) -> None:
+        self.server.statuses = [503]
+        sched = self.make_scheduler()
+
+        sched.run(self.url, None, self.fetch)
+        state = sched.hosts["127.0.0.1"]
+        self.assertEqual(state.limit, 2)
+        sched.run(self.url, None, self.fetch)
+        self.assertEqual(state.limit, 3)
+        for _ in range(3):
+            sched.run(self.url, None, self.fetch)
+        self.assertEqual(state.limit, 4)
+
+    def test_gives_up_after_retries(self) -> None:
+        self.server.statuses = [429] * 3
+        sched = self.make_scheduler(throttle_retries=2)
+
+        with self.assertRaises(urllib.error.HTTPError):
+            sched.run(self.url, None, self.fetch)
+        self.assertEqual(self.server.requests, 3)
+        self.assertEqual(sched.hosts["127.0.0.1"].active, 0)
+
+    def test_other_errors_are_not_retried(self) -> None:
+        self.server.statuses = [404]
+        sched = self.make_scheduler()
+
+        with self.assertRaises(urllib.error.HTTPError):
+            sched.run(self.url, None, self.fetch)
+        self.assertEqual(self.server.requests, 1)
+        self.assertEqual(self.sleeps, [])
+        self.assertEqual(sched.hosts["127.0.0.1"].limit, 4)
+
+    def test_requests_are_paced(self) -> None:
+        sched = self.make_scheduler(host_requests_per_second=2)
+
+        for _ in range(3):
+            sched.run(self.url, None, self.fetch)
+        self.assertEqual(self.sleeps, [0.5, 0.5])
+
+    def test_ids_are_not_mistaken_for_throttling(self) -> None:
+        error = Exception(
+            "ERROR: [soundcloud] 1234294290: Unable to download JSON "
+            "metadata: HTTP Error 404: Not Found"
+        )
+        self.assertFalse(scheduler.is_throttled(error))
+        self.assertTrue(scheduler.is_throttled(
+            Exception("HTTP Error 429: Too Many Requests")
+        ))
+
+if __name__ == "__main__":
+    unittest.main()